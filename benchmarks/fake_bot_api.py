@@ -0,0 +1,90 @@
+# Локальная замена Telegram Bot API на aiohttp для нагрузочных тестов.
+# Отвечает на методы, которыми пользуется бот, записывает все вызовы и умеет
+# добавлять задержку и отвечать 429 с retry_after.
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency        # секунд на ответ
+        self.flood_rate = flood_rate  # доля запросов, получающих 429
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.floods = 0
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner = None
+        self.url = None
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls.clear()
+        self.floods = 0
+
+    def _message(self, params: dict) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def _photo_message(self, params: dict) -> dict:
+        message = self._message(params)
+        file_id = f"photo-{next(self._file_ids)}"
+        message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+        return message
+
+    def _result(self, method: str, params: dict):
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "bench"}
+        if method == "sendphoto":
+            return self._photo_message(params)
+        if method == "sendmediagroup":
+            return [self._photo_message(params) for _ in json.loads(params.get("media", "[]"))]
+        if method.startswith("send") or method == "copymessage":
+            return self._message(params)
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = {k: v for k, v in (await request.post()).items() if isinstance(v, str)}
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,160 @@
+# In-memory замена AsyncDatabase для нагрузочных тестов: те же методы, что вызывает бот,
+# данные в словарях, настраиваемая задержка на каждый запрос и счётчик запросов.
+
+import asyncio
+from collections import Counter
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency  # секунд на один запрос
+        self.calls = Counter()
+        self.users: dict = {}      # tg_user_id -> role
+        self.admins: set = set()
+        self.clients: dict = {}    # tg_user_id -> tel_num
+        self.last_messages: dict = {}
+        self.photo_cache: dict = {}
+        self.outbox: list = []     # строки client_update_outbox
+        self.notif_counters: dict = {}  # tg_user_id -> notif_count, last_notif_date
+        self.pool_waiting = 0
+        self.max_size = 0
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    async def _query(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    # ----------helping_methods-------------
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def connect_listener(self):
+        raise ConnectionError("FakeDatabase не поддерживает LISTEN")
+
+    def pool_stats(self) -> dict:
+        return {"size": 0, "idle": 0, "waiting": 0, "max": 0}
+
+    async def execute(self, query: str, *args):
+        await self._query('execute')
+
+    async def fetch(self, query: str, *args, read_only: bool = False):
+        await self._query('fetch')
+        if 'FROM admin_info' in query:
+            return [{'tg_user_id': tg} for tg in self.admins]
+        if 'FROM user_info' in query:
+            return [{'tg_user_id': tg, 'role': role} for tg, role in self.users.items()]
+        return []
+
+    async def fetchrow(self, query: str, *args, read_only: bool = False):
+        await self._query('fetchrow')
+        return None
+
+    async def fetchval(self, query: str, *args, column: int = 0, read_only: bool = False):
+        await self._query('fetchval')
+        return None
+
+    # ----------user-------------
+    async def register_user(self, tg_user_id: int, role: str) -> bool:
+        await self._query('register_user')
+        if role == 'admin':
+            self.admins.add(tg_user_id)
+        if tg_user_id in self.users:
+            return False
+        self.users[tg_user_id] = role
+        return True
+
+    async def client_registration(self, tg_user_id, phone_number):
+        await self._query('client_registration')
+        self.clients[tg_user_id] = phone_number
+
+    async def get_id_from_phone(self, phone):
+        await self._query('get_id_from_phone')
+        for tg, tel in self.clients.items():
+            if tel == phone:
+                return tg
+        return None
+
+    async def change_phone(self, tg_user_id: int, phone: str):
+        await self._query('change_phone')
+        self.clients[tg_user_id] = phone
+
+    async def get_all_admin_ids(self):
+        await self._query('get_all_admin_ids')
+        return list(self.admins)
+
+    # ----------messages-------------
+    async def set_last_message_by_user_id(self, tg_user_id, last_message):
+        await self._query('set_last_message_by_user_id')
+        if not isinstance(last_message, list):
+            last_message = [last_message]
+        self.last_messages.setdefault(tg_user_id, []).extend(last_message)
+
+    async def take_last_messages_by_user_id(self, tg_user_id: int):
+        await self._query('take_last_messages_by_user_id')
+        return self.last_messages.pop(tg_user_id, [])
+
+    # ----------photo_cache-------------
+    async def get_photo_cache_entry(self, path: str):
+        await self._query('get_photo_cache_entry')
+        return self.photo_cache.get(path)
+
+    async def get_photo_file_id_by_hash(self, content_hash: str):
+        await self._query('get_photo_file_id_by_hash')
+        for row in self.photo_cache.values():
+            if row['content_hash'] == content_hash:
+                return row['file_id']
+        return None
+
+    async def save_photo_cache_entry(self, path, mtime_ns, size, content_hash, file_id):
+        await self._query('save_photo_cache_entry')
+        self.photo_cache[path] = {
+            'mtime_ns': mtime_ns, 'size': size, 'content_hash': content_hash, 'file_id': file_id
+        }
+
+    async def delete_photo_cache_entry(self, path: str):
+        await self._query('delete_photo_cache_entry')
+        self.photo_cache.pop(path, None)
+
+    # ----------notif_quota-------------
+    async def get_notif_counter(self, tg_user_id: int):
+        await self._query('get_notif_counter')
+        return self.notif_counters.get(tg_user_id)
+
+    async def save_notif_counters(self, tg_user_ids, deltas, days):
+        await self._query('save_notif_counters')
+        for tg, delta, day in zip(tg_user_ids, deltas, days):
+            row = self.notif_counters.get(tg)
+            if row and row['last_notif_date'] == day:
+                delta += row['notif_count']
+            self.notif_counters[tg] = {'notif_count': delta, 'last_notif_date': day}
+
+    # ----------client_update_outbox-------------
+    def add_client_update(self, tg_user_id: int, payload: str):
+        self.outbox.append({'id': len(self.outbox) + 1, 'tg_user_id': tg_user_id,
+                            'payload': payload, 'claimed': False})
+
+    async def claim_client_updates(self, batch_size: int, lease: int):
+        await self._query('claim_client_updates')
+        rows = [r for r in self.outbox if not r['claimed']][:batch_size]
+        for r in rows:
+            r['claimed'] = True
+        return rows
+
+    async def ack_client_updates(self, ids):
+        await self._query('ack_client_updates')
+
+    async def purge_client_updates(self, keep_days: int):
+        await self._query('purge_client_updates')
+
+    async def sync_client_update_trigger(self, columns):
+        pass
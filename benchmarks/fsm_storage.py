@@ -0,0 +1,102 @@
+# Микро-бенчмарк FSM-хранилищ: MemoryStorage против PostgresStorage.
+#
+# Прогоняет сценарий PhoneState (/start -> ввод телефона -> confirm_phone) для N пользователей
+# так же, как это делает aiogram: чтение состояния на каждый апдейт, затем запись в хендлере
+# и flush из FSMFlushMiddleware. База подменяется фейком с задержкой на запрос;
+# «записи» — число SQL-операторов записи, при параллельных пользователях они пакетируются.
+#
+#   python benchmarks/fsm_storage.py [пользователей] [задержка_мс]
+
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import PostgresStorage
+
+
+class FakeDatabase:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+
+    async def fetchrow(self, query, *args):
+        self.reads += 1
+        await asyncio.sleep(self.latency)
+        return None
+
+    async def execute(self, query, *args):
+        self.writes += 1
+        await asyncio.sleep(self.latency)
+
+
+class EagerStorage(PostgresStorage):
+    # Каждая запись сразу уходит в базу — так работало бы хранилище без склейки
+    async def set_state(self, key, state=None):
+        await super().set_state(key, state)
+        await self.flush()
+
+    async def set_data(self, key, data):
+        await super().set_data(key, data)
+        await self.flush()
+
+
+async def phone_flow(storage, user_id: int, flush):
+    key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+    state = FSMContext(storage=storage, key=key)
+
+    # /start
+    await state.get_state()
+    await state.set_state("PhoneState:waiting_for_phone")
+    await flush()
+
+    # ввод телефона
+    await state.get_state()
+    await state.update_data(phone_number="79990000000")
+    await flush()
+
+    # confirm_phone
+    await state.get_state()
+    await state.get_data()
+    await state.clear()
+    await flush()
+
+
+async def run(title, storage, users, flush, db=None):
+    started = time.perf_counter()
+    await asyncio.gather(*[phone_flow(storage, uid, flush) for uid in range(users)])
+    elapsed = time.perf_counter() - started
+    handlers = users * 3
+    line = f"{title:<32}{handlers / elapsed:>12.0f} хендлеров/с"
+    if db is not None:
+        line += f"{db.writes / handlers:>8.2f} записей/хендлер{db.reads / handlers:>8.2f} чтений/хендлер"
+    print(line)
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 1.0) / 1000
+
+    async def no_flush():
+        pass
+
+    await run("MemoryStorage", MemoryStorage(), users, no_flush)
+
+    db = FakeDatabase(latency)
+    await run("PostgresStorage (без склейки)", EagerStorage(db), users, no_flush, db)
+
+    db = FakeDatabase(latency)
+    storage = PostgresStorage(db)
+    await run("PostgresStorage", storage, users, storage.flush, db)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,248 @@
+# Нагрузочный тест бота без сети и без PostgreSQL.
+#
+# Поднимает локальную замену Bot API (fake_bot_api), подменяет базу на FakeDatabase
+# и прогоняет синтетические апдейты через dp.feed_update настоящего Dispatcher из main.py.
+# Сценарии: массовый /start, подтверждение телефона (PhoneState), смена номера админом
+# (ChangePhoneStates) и шторм изменений client_info через outbox.
+#
+#   python -m benchmarks.load_test --users 500 --db-latency 1 --api-latency 5
+#   python -m benchmarks.load_test --scenario notify --flood-rate 0.01
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:load-test")
+os.environ.setdefault("metrics_port", "0")
+
+# Логи бота не должны попадать в app.log
+logging.basicConfig(level=logging.CRITICAL)
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+
+import main
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.fake_database import FakeDatabase
+
+ADMIN_ID = 1
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+# ----------синтетические апдейты-------------
+class Updates:
+    def __init__(self):
+        self._ids = iter(range(1, 10 ** 9))
+
+    def _user(self, tg: int) -> dict:
+        return {"id": tg, "is_bot": False, "first_name": f"user{tg}"}
+
+    def message(self, tg: int, text: str) -> dict:
+        return {"update_id": next(self._ids), "message": {
+            "message_id": next(self._ids), "date": int(time.time()),
+            "chat": {"id": tg, "type": "private"}, "from": self._user(tg), "text": text,
+        }}
+
+    def callback(self, tg: int, data: str) -> dict:
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "from": self._user(tg), "chat_instance": str(tg), "data": data,
+            "message": {"message_id": next(self._ids), "date": int(time.time()),
+                        "chat": {"id": tg, "type": "private"}, "text": "Все верно?"},
+        }}
+
+
+# ----------сценарии: список апдейтов на пользователя (выполняются по порядку)-------------
+def scenario_start(db, updates, users):
+    return {tg: [updates.message(tg, "/start")] for tg in range(1000, 1000 + users)}
+
+
+def scenario_phone(db, updates, users):
+    flows = {}
+    for i, tg in enumerate(range(1000, 1000 + users)):
+        flows[tg] = [
+            updates.message(tg, "/start"),
+            updates.message(tg, f"79{i:09d}"),
+            updates.callback(tg, "confirm_phone"),
+        ]
+    return flows
+
+
+def scenario_admin(db, updates, users):
+    flows = {}
+    for i, admin in enumerate(range(ADMIN_ID, ADMIN_ID + users)):
+        client, phone = 100000 + i, f"79{i:09d}"
+        db.users[client] = 'client'
+        db.clients[client] = phone
+        db.users[admin] = db.users.get(admin, 'admin')
+        main.identity_cache.configured_admins |= {admin}
+        flows[admin] = [
+            updates.callback(admin, "admin_change_phone"),
+            updates.message(admin, phone),
+            updates.message(admin, f"78{i:09d}"),
+        ]
+    return flows
+
+
+SCENARIOS = {
+    "start": ("/start, новые пользователи", scenario_start),
+    "phone": ("PhoneState: /start -> телефон -> confirm_phone", scenario_phone),
+    "admin": ("ChangePhoneStates: смена номера админом", scenario_admin),
+}
+
+
+# ----------прогон-------------
+async def run_updates(bot, flows: dict):
+    latencies = []
+
+    async def user_flow(items):
+        for raw in items:
+            update = Update.model_validate(raw, context={"bot": bot})
+            started = time.perf_counter()
+            await main.dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*[user_flow(items) for items in flows.values()])
+    return latencies
+
+
+async def run_notify_storm(db, users: int, photo: str, receipt: str):
+    # Шторм изменений client_info: сотрудник по очереди меняет текст, фото изделия,
+    # ещё раз текст и фото квитанции. При включённом слиянии клиент получает один альбом.
+    # Задержка — от начала шторма до отправки уведомления клиенту.
+    for tg in range(1000, 1000 + users):
+        db.add_client_update(tg, json.dumps({"notif_text": f"Заказ {tg} принят"}))
+        db.add_client_update(tg, json.dumps({"product_photo_path": photo}))
+        db.add_client_update(tg, json.dumps({"notif_text": f"Заказ {tg} готов"}))
+        db.add_client_update(tg, json.dumps({"receipt_photo_path": receipt}))
+    outbox = main.notification_outbox
+    handler, latencies = outbox.handler, []
+    started = time.perf_counter()
+
+    def delivered(_future=None):
+        latencies.append(time.perf_counter() - started)
+
+    async def timed(tg_user_id, payload):
+        result = await handler(tg_user_id, payload)
+        if asyncio.isfuture(result):
+            result.add_done_callback(delivered)
+        else:
+            delivered()
+        return result
+
+    outbox.handler = timed
+    # Без слушателя и advisory-блокировки: этот процесс считается лидером
+    outbox._leader = True
+    try:
+        outbox.pipeline.start()
+        await outbox.drain()
+        await outbox.pipeline.close(drain=True)
+        await main.notification_coalescer.close()
+        await outbox._flush_acks()
+        await main.notification_quota.flush()
+    finally:
+        outbox.handler = handler
+        outbox._leader = False
+    return latencies
+
+
+def report(title: str, events: int, elapsed: float, latencies, api: FakeBotAPI, db: FakeDatabase):
+    print(f"\n== {title}")
+    print(f"  апдейтов:          {events} за {elapsed:.2f}s ({events / elapsed:.0f}/s)")
+    print(f"  задержка p50/p99:  {percentile(latencies, 0.5) * 1000:.1f} / {percentile(latencies, 0.99) * 1000:.1f} мс")
+    print(f"  Bot API на апдейт: {api.total_calls / events:.2f}  {dict(api.calls)}"
+          + (f"  429: {api.floods}" if api.floods else ""))
+    print(f"  БД на апдейт:      {db.total_calls / events:.2f}  {dict(db.calls)}")
+
+
+async def main_async(args):
+    api = FakeBotAPI(latency=args.api_latency / 1000, flood_rate=args.flood_rate)
+    url = await api.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(url))
+    bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"], session=session)
+    session.middleware(main.send_scheduler)
+
+    main.send_scheduler.rate = args.send_rate
+    main.send_scheduler.chat_interval = args.chat_interval
+    main.send_scheduler.start()
+    main.bot = bot
+    if args.coalesce_window is not None:
+        main.notify_coalesce_window = args.coalesce_window
+        main.notification_coalescer.window = args.coalesce_window
+
+    photo_dir = tempfile.mkdtemp()
+    photo = os.path.join(photo_dir, "product.jpg")
+    receipt = os.path.join(photo_dir, "receipt.jpg")
+    for path in (photo, receipt):
+        with open(path, "wb") as f:
+            f.write(os.urandom(200 * 1024))
+
+    selected = list(SCENARIOS) + ["notify"] if args.scenario == "all" else [args.scenario]
+    try:
+        for name in selected:
+            db = FakeDatabase(latency=args.db_latency / 1000)
+            # Все компоненты бота работают с подменённой базой
+            main.database = db
+            for component in (main.photo_cache, main.identity_cache, main.notification_outbox, main.storage,
+                              main.notification_quota):
+                if hasattr(component, "database"):
+                    component.database = db
+            main.identity_cache.roles, main.identity_cache.admin_ids = {}, set()
+            main.identity_cache.configured_admins = frozenset()
+            updates = Updates()
+            api.reset_calls()
+
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                started = time.perf_counter()
+                if name == "notify":
+                    latencies = await run_notify_storm(db, args.users, photo, receipt)
+                    events = len(latencies)
+                    title = "Шторм изменений client_info через outbox"
+                else:
+                    title, build = SCENARIOS[name]
+                    flows = build(db, updates, args.users)
+                    db.reset_calls()
+                    latencies = await run_updates(bot, flows)
+                    events = len(latencies)
+                if hasattr(main.storage, "flush"):
+                    await main.storage.flush()
+                elapsed = time.perf_counter() - started
+            report(title, events, elapsed, latencies, api, db)
+    finally:
+        await main.send_scheduler.close()
+        await bot.session.close()
+        await api.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на фейковых Bot API и БД")
+    parser.add_argument("--scenario", choices=list(SCENARIOS) + ["notify", "all"], default="all")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--db-latency", type=float, default=1.0, help="мс на запрос к БД")
+    parser.add_argument("--api-latency", type=float, default=5.0, help="мс на ответ Bot API")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    # По умолчанию лимиты Telegram сняты, чтобы мерить сам бот, а не планировщик
+    parser.add_argument("--send-rate", type=float, default=1e9, help="сообщений/с (как send_rate)")
+    parser.add_argument("--coalesce-window", type=float, default=None,
+                        help="секунд слияния уведомлений (как notify_coalesce_window)")
+    parser.add_argument("--chat-interval", type=float, default=0.0, help="секунд между сообщениями в чат")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main_async(parse_args()))
@@ -0,0 +1,152 @@
+# Подсчёт обращений к PostgreSQL на каждый хендлер бота — до и после переработки database.py.
+#
+# Реальная база не нужна: пул подменяется записывающим соединением, которое считает
+# каждое обращение к серверу (запрос, BEGIN, COMMIT, подготовку statement).
+# «До» — database.py из первого коммита репозитория (или файл, переданный аргументом).
+#
+#   python benchmarks/round_trips.py [path/to/old_database.py]
+
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import types
+from contextlib import asynccontextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Глушим логирование до импорта database.py, чтобы не писать в app.log
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class RecordingStatement:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def fetch(self, *args):
+        self.connection.trips += 1
+        return self.connection.rows
+
+    async def fetchrow(self, *args):
+        self.connection.trips += 1
+        return None
+
+    async def fetchval(self, *args):
+        self.connection.trips += 1
+        return self.connection.scalar
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.trips = 0
+        self.scalar = None
+        self.rows = []
+        self.prepared = set()
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.trips += 1  # BEGIN
+        yield
+        self.trips += 1  # COMMIT
+
+    async def execute(self, query, *args):
+        self.trips += 1
+        return "OK"
+
+    async def fetch(self, query, *args):
+        self.trips += 1
+        return self.rows
+
+    async def fetchrow(self, query, *args):
+        self.trips += 1
+        return None
+
+    async def fetchval(self, query, *args, column=0):
+        self.trips += 1
+        return self.scalar
+
+    async def named_statement(self, name):
+        if name not in self.prepared:
+            self.trips += 1  # Parse/Describe — только при первом использовании на соединении
+            self.prepared.add(name)
+        return RecordingStatement(self)
+
+    def forget_statement(self, name):
+        self.prepared.discard(name)
+
+
+class RecordingPool:
+    def __init__(self):
+        self.connection = RecordingConnection()
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.connection
+
+
+# Последовательности вызовов базы, которые делают хендлеры main.py
+BEFORE = {
+    "/start (новый клиент)": [("user_exists", False, 1), ("user_registration", None, 1, "client")],
+    "/start (новый админ)": [("user_exists", False, 1), ("user_registration", None, 1, "admin"),
+                            ("admin_registration", None, 1)],
+    "/start (повторный)": [("user_exists", True, 1)],
+    "ввод телефона": [("set_last_message_by_user_id", True, 1, 10)],
+    "confirm_phone": [("get_last_messages_by_user_id", None, 1), ("clear_last_message_ids_by_user_id", True, 1),
+                      ("client_registration", None, 1, "79990000000"), ("get_all_admin_ids", None)],
+    "смена номера админом": [("get_id_from_phone", 1, "79990000000"), ("change_phone", None, 1, "79990000001")],
+}
+
+AFTER = dict(BEFORE)
+AFTER.update({
+    "/start (новый клиент)": [("register_user", True, 1, "client")],
+    "/start (новый админ)": [("register_user", True, 1, "admin")],
+    "/start (повторный)": [("register_user", False, 1, "client")],
+    "confirm_phone": [("take_last_messages_by_user_id", None, 1),
+                      ("client_registration", None, 1, "79990000000"), ("get_all_admin_ids", None)],
+})
+
+
+def load_module(name, source):
+    module = types.ModuleType(name)
+    exec(compile(source, name, "exec"), module.__dict__)
+    return module
+
+
+def baseline_source(path=None):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    root = subprocess.check_output(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=ROOT, text=True).split()[0]
+    return subprocess.check_output(["git", "show", f"{root}:database.py"], cwd=ROOT, text=True)
+
+
+async def count(module, scenarios) -> dict:
+    result = {}
+    for title, calls in scenarios.items():
+        db = module.AsyncDatabase("bench", "bench", "bench")
+        db.pool = RecordingPool()
+        connection = db.pool.connection
+        for _ in (False, True):  # второй прогон — соединение с уже подготовленными запросами
+            connection.trips = 0
+            for method, scalar, *args in calls:
+                connection.scalar = scalar
+                await getattr(db, method)(*args)
+        result[title] = connection.trips
+    return result
+
+
+async def main():
+    before = await count(load_module("database_before", baseline_source(sys.argv[1] if len(sys.argv) > 1 else None)), BEFORE)
+    import database
+    after = await count(database, AFTER)
+
+    print(f"{'хендлер':<24}{'до':>6}{'после':>8}")
+    for title in BEFORE:
+        print(f"{title:<24}{before[title]:>6}{after[title]:>8}")
+    print(f"{'итого':<24}{sum(before.values()):>6}{sum(after.values()):>8}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
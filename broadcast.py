@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import re
+import socket
+import uuid
+from datetime import datetime
+
+from sender import bulk_priority
+
+logger = logging.getLogger(__name__)
+
+STATE_TITLES = {
+    'running': 'идёт',
+    'paused': 'на паузе',
+    'cancelled': 'отменена',
+    'done': 'завершена',
+}
+
+
+# Сегмент из текста админа: "все", "статус 2", "дата 01.01.2024-31.01.2024" или их сочетание.
+# Возвращает {'item_status': int|None, 'reg_from': date|None, 'reg_to': date|None}.
+def parse_segment(text: str) -> dict:
+    text = text.strip().lower()
+    segment = {'item_status': None, 'reg_from': None, 'reg_to': None}
+    if text in ('все', 'all'):
+        return segment
+    status = re.search(r'(?:статус|status)\s*:?\s*(\d+)', text)
+    dates = re.search(r'(?:дата|date)\s*:?\s*(\d{2}\.\d{2}\.\d{4})?\s*-\s*(\d{2}\.\d{2}\.\d{4})?', text)
+    if not status and not dates:
+        raise ValueError("Не понял сегмент")
+    if status:
+        segment['item_status'] = int(status.group(1))
+    if dates:
+        if dates.group(1):
+            segment['reg_from'] = datetime.strptime(dates.group(1), '%d.%m.%Y').date()
+        if dates.group(2):
+            segment['reg_to'] = datetime.strptime(dates.group(2), '%d.%m.%Y').date()
+    return segment
+
+
+def describe_segment(campaign) -> str:
+    parts = []
+    if campaign['item_status'] is not None:
+        parts.append(f"статус {campaign['item_status']}")
+    if campaign['reg_from'] or campaign['reg_to']:
+        reg_from = campaign['reg_from'].strftime('%d.%m.%Y') if campaign['reg_from'] else '…'
+        reg_to = campaign['reg_to'].strftime('%d.%m.%Y') if campaign['reg_to'] else '…'
+        parts.append(f"регистрация {reg_from}-{reg_to}")
+    return ', '.join(parts) or 'все клиенты'
+
+
+def describe_campaign(campaign) -> str:
+    return (f"Рассылка #{campaign['id']} ({describe_segment(campaign)}): "
+            f"{STATE_TITLES.get(campaign['state'], campaign['state'])}, "
+            f"отправлено {campaign['sent']} из {campaign['total']}, ошибок {campaign['failed']}")
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class BroadcastManager:
+    # Отправка рассылок из таблицы broadcast_campaign.
+    # Получатели читаются пачками по batch_size после курсора кампании (keyset по tg_user_id),
+    # поэтому в памяти только одна пачка id. Пачка отправляется через send с низким
+    # приоритетом планировщика — интерактивные ответы идут вперёд. После пачки курсор
+    # подтверждается в базе и аренда кампании продлевается; в ответ приходит состояние,
+    # так пауза и отмена (из любого процесса) вступают в силу после текущей пачки.
+    # Если процесс упал, аренда истекает и кампанию подхватывает фоновое восстановление.
+    # Пока пачка отправляется, аренда продлевается каждые lease/3 секунд, а подтверждать пачки
+    # может только владелец аренды (owner): если её всё же забрал другой процесс,
+    # этот прекращает отправку, и одну кампанию не шлют двое.
+    def __init__(self, database, send, on_finish=None, batch_size: int = 100, lease: int = 60,
+                 poll_interval: float = 30):
+        self.database = database
+        self.send = send  # корутина send(campaign, tg_user_id): отправка одному получателю
+        self.on_finish = on_finish  # корутина on_finish(campaign): кампания завершена
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._runs: dict = {}  # campaign_id -> Task
+        self._task = None
+
+        # Счётчики
+        self.sent = 0
+        self.failed = 0
+
+    # ----------helping_methods-------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._recover_forever())
+
+    async def close(self):
+        tasks = [t for t in (self._task, *self._runs.values()) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._runs = {}
+
+    def active(self) -> int:
+        return len(self._runs)
+
+    # Запускает кампанию в этом процессе, если её никто не отправляет
+    async def launch(self, campaign_id: int = None):
+        for campaign in await self.database.claim_campaigns(self.lease, self.owner, campaign_id):
+            if campaign['id'] not in self._runs:
+                self._runs[campaign['id']] = asyncio.create_task(self._run(campaign))
+
+    async def _send_one(self, campaign, tg_user_id: int) -> bool:
+        try:
+            await self.send(campaign, tg_user_id)
+            return True
+        except Exception as e:
+            logger.info(f"Рассылка #{campaign['id']}: не доставлено {tg_user_id}: {e}")
+            return False
+
+    # Ждёт отправку пачки, продлевая аренду; потеряв аренду, отменяет оставшиеся отправки
+    async def _send_batch(self, campaign_id: int, sending: asyncio.Future) -> list:
+        try:
+            while True:
+                done, _ = await asyncio.wait([sending], timeout=self.lease / 3)
+                if done:
+                    return sending.result()
+                if not await self.database.renew_campaign(campaign_id, self.owner, self.lease):
+                    raise LeaseLost()
+        finally:
+            if not sending.done():
+                sending.cancel()
+                await asyncio.gather(sending, return_exceptions=True)
+
+    async def _run(self, campaign):
+        campaign_id = campaign['id']
+        cursor = campaign['cursor']
+        finished = False
+        try:
+            while True:
+                recipients = await self.database.get_campaign_recipients(campaign, cursor, self.batch_size)
+                if not recipients:
+                    finished = True
+                    break
+                with bulk_priority():
+                    sending = asyncio.gather(*[self._send_one(campaign, tg) for tg in recipients])
+                results = await self._send_batch(campaign_id, sending)
+                sent = sum(results)
+                self.sent += sent
+                self.failed += len(results) - sent
+                cursor = recipients[-1]
+                state = await self.database.ack_campaign(
+                    campaign_id, self.owner, cursor, sent, len(results) - sent, self.lease
+                )
+                if state is None:
+                    raise LeaseLost()
+                if state != 'running':
+                    logger.warning(f"Рассылка #{campaign_id} остановлена: {state}")
+                    break
+        except asyncio.CancelledError:
+            raise
+        except LeaseLost:
+            logger.warning(f"Рассылка #{campaign_id}: аренду забрал другой процесс, отправка остановлена")
+            return
+        except Exception as e:
+            # Аренду не снимаем: после её истечения кампанию подхватит восстановление
+            logger.error(f"Ошибка рассылки #{campaign_id}: {e}")
+            return
+        finally:
+            self._runs.pop(campaign_id, None)
+
+        campaign = await self.database.release_campaign(campaign_id, self.owner, finished=finished)
+        if finished and self.on_finish and campaign:
+            try:
+                await self.on_finish(campaign)
+            except Exception as e:
+                logger.error(f"Не удалось сообщить о завершении рассылки #{campaign_id}: {e}")
+
+    # ----------background_tasks-------------
+    async def _recover_forever(self):
+        while True:
+            try:
+                await self.launch()
+            except Exception as e:
+                logger.error(f"Ошибка при восстановлении рассылок: {e}")
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,128 @@
+import csv
+import logging
+import re
+
+try:
+    import openpyxl  # из requirements.txt; нужна только для импорта .xlsx
+except ImportError:
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+PHONE_RE = re.compile(r'^7\d{10}$')
+
+# Столбцы staging-таблицы client_import_staging в порядке записей
+COLUMNS = ('line_no', 'tel_num', 'first_name', 'last_name', 'item_status')
+
+# Допустимые заголовки столбцов файла
+HEADERS = {
+    'tel_num': 'tel_num', 'phone': 'tel_num', 'телефон': 'tel_num', 'номер': 'tel_num',
+    'first_name': 'first_name', 'имя': 'first_name',
+    'last_name': 'last_name', 'фамилия': 'last_name',
+    'item_status': 'item_status', 'status': 'item_status', 'статус': 'item_status',
+}
+# Порядок столбцов, если в файле нет строки заголовка
+DEFAULT_ORDER = ('tel_num', 'first_name', 'last_name', 'item_status')
+
+
+# ----------чтение файла построчно-------------
+def _csv_rows(path: str):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _xlsx_rows(path: str):
+    if openpyxl is None:
+        raise ValueError("Для импорта .xlsx нужен пакет openpyxl")
+    # read_only: строки читаются из файла по одной, а не загружаются целиком
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ['' if v is None else str(v) for v in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(path: str, filename: str):
+    if filename.lower().endswith('.xlsx'):
+        return _xlsx_rows(path)
+    return _csv_rows(path)
+
+
+class ImportReport:
+    # Итоги импорта: счётчики и первые примеры отклонённых строк (не больше max_examples)
+    def __init__(self, max_examples: int = 20):
+        self.max_examples = max_examples
+        self.total = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.examples: list = []
+        self.updated = 0  # обновлено существующих клиентов
+        self.pending = 0  # номеров ждут регистрации клиента в боте
+
+    def reject(self, line_no: int, reason: str):
+        self.rejected += 1
+        if len(self.examples) < self.max_examples:
+            self.examples.append(f"строка {line_no}: {reason}")
+
+    def summary(self) -> str:
+        lines = [
+            f"Импорт завершён. Строк: {self.total}, принято: {self.accepted}, отклонено: {self.rejected}.",
+            f"Обновлено клиентов: {self.updated}, ожидают регистрации: {self.pending}.",
+        ]
+        if self.examples:
+            lines.append("Отклонённые строки:")
+            lines.extend(self.examples)
+            if self.rejected > len(self.examples):
+                lines.append(f"... и ещё {self.rejected - len(self.examples)}")
+        return '\n'.join(lines)
+
+
+# Имя и фамилия: пустые — NULL, длинные обрезаются до VARCHAR(100)
+def _name(values: dict, key: str):
+    return values.get(key, '')[:100] or None
+
+
+# Проверяет строки файла и отдаёт записи для COPY пачками по chunk_size.
+# Работает как генератор: в памяти одновременно только одна пачка.
+def parse_records(rows, report: ImportReport, chunk_size: int = 5000):
+    order = None
+    chunk = []
+    for line_no, row in enumerate(rows, start=1):
+        cells = [c.strip() for c in row]
+        if not any(cells):
+            continue
+        if order is None:
+            names = [HEADERS.get(c.lower()) for c in cells]
+            if 'tel_num' in names:
+                order = names
+                continue
+            order = DEFAULT_ORDER
+
+        report.total += 1
+        values = dict(zip(order, cells))
+        values.pop(None, None)
+        phone = re.sub(r'[\s()+-]', '', values.get('tel_num', ''))
+        if not PHONE_RE.match(phone):
+            report.reject(line_no, f"неверный номер {values.get('tel_num', '')[:20]!r}")
+            continue
+        status = values.get('item_status') or None
+        if status is not None:
+            if not status.isdigit():
+                report.reject(line_no, f"неверный статус {status[:20]!r}")
+                continue
+            status = int(status)
+
+        chunk.append((line_no, phone, _name(values, 'first_name'), _name(values, 'last_name'), status))
+        report.accepted += 1
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -9,4 +9,115 @@ user = os.getenv("user")
 password = os.getenv("password")
 host = os.getenv("host")
 port = os.getenv("port")
-admin_tg_ids = os.getenv("admin_tg_ids")
\ No newline at end of file
+admin_tg_ids = os.getenv("admin_tg_ids")
+# Лимиты исходящих сообщений Telegram
+send_rate = float(os.getenv("send_rate", "30"))  # сообщений в секунду на бота
+send_chat_interval = float(os.getenv("send_chat_interval", "1.0"))  # секунд между сообщениями в один чат
+
+# Пайплайн уведомлений client_update
+notify_workers = int(os.getenv("notify_workers", "4"))  # число воркеров
+notify_queue_size = int(os.getenv("notify_queue_size", "1000"))  # общий размер очереди
+
+# Кэш file_id фотографий
+photo_cache_size = int(os.getenv("photo_cache_size", "1024"))  # записей file_id в памяти
+
+# Подготовка фото перед загрузкой: уменьшение и пересжатие в пуле процессов (нужен Pillow)
+image_prep = os.getenv("image_prep", "1") == "1"
+image_cache_dir = os.getenv("image_cache_dir", "image_cache")  # каталог подготовленных копий
+image_cache_max_mb = int(os.getenv("image_cache_max_mb", "1024"))  # предел каталога копий, МБ (0 — без предела)
+image_max_side = int(os.getenv("image_max_side", "2560"))  # пикселей по большей стороне
+image_quality = int(os.getenv("image_quality", "85"))  # качество JPEG
+image_workers = int(os.getenv("image_workers", "2"))  # процессов в пуле
+image_min_bytes = int(os.getenv("image_min_bytes", str(300 * 1024)))  # файлы меньше отправляются как есть
+# Квитанции отправлять документом в исходном разрешении ("1") вместо сжатого фото
+receipt_as_document = os.getenv("receipt_as_document", "0") == "1"
+
+# Кэш ролей и пользователей: сколько секунд доверять данным без слушателя NOTIFY
+identity_cache_ttl = float(os.getenv("identity_cache_ttl", "60"))
+
+# Хранилище FSM: 'postgres' (по умолчанию) или 'memory'
+fsm_storage_backend = os.getenv("fsm_storage", "postgres")
+fsm_cache_size = int(os.getenv("fsm_cache_size", "10000"))  # записей в локальном кэше
+fsm_flush_delay = float(os.getenv("fsm_flush_delay", "0.5"))  # секунд до фонового сброса изменений
+
+# Webhook-режим (python webhook.py)
+webhook_host = os.getenv("webhook_host", "0.0.0.0")
+webhook_port = int(os.getenv("webhook_port", "8080"))
+webhook_path = os.getenv("webhook_path", "/webhook")
+webhook_url = os.getenv("webhook_url")  # публичный адрес; если не задан, setWebhook не вызывается
+# X-Telegram-Bot-Api-Secret-Token; без него сервер поднимается только на localhost
+# (при заданном webhook_url секрет генерируется на каждый запуск)
+webhook_secret = os.getenv("webhook_secret")
+webhook_workers = int(os.getenv("webhook_workers", "4"))  # число процессов-обработчиков
+webhook_queue_size = int(os.getenv("webhook_queue_size", "1000"))  # апдейтов в очереди процесса
+
+# Outbox уведомлений client_update
+outbox_batch_size = int(os.getenv("outbox_batch_size", "100"))  # строк за один запрос
+outbox_lease = int(os.getenv("outbox_lease", "300"))  # секунд аренды строки до повторной отправки
+outbox_standby_interval = float(os.getenv("outbox_standby_interval", "5"))  # секунд между попытками резерва стать лидером
+# Строк, ожидающих отложенной (слитой) отправки; держать меньше send_rate * outbox_lease
+outbox_max_deferred = int(os.getenv("outbox_max_deferred", "1000"))
+
+# Столбцы client_info, изменение которых отправляется клиенту (через запятую)
+notify_columns = [c.strip() for c in os.getenv(
+    "notify_columns", "notif_text,product_photo_path,receipt_photo_path"
+).split(",") if c.strip()]
+
+# Слияние изменений одного клиента: секунд тишины до отправки (0 — без слияния) и максимум ожидания
+notify_coalesce_window = float(os.getenv("notify_coalesce_window", "2"))
+notify_coalesce_max_delay = float(os.getenv("notify_coalesce_max_delay", "10"))
+
+# Дневной лимит уведомлений на клиента (0 — без лимита) и период записи счётчиков в базу, секунд
+notify_daily_limit = int(os.getenv("notify_daily_limit", "20"))
+notify_quota_flush_interval = float(os.getenv("notify_quota_flush_interval", "5"))
+
+# Статистика для админа: секунд жизни снимка в памяти и за сколько дней он читается
+stats_cache_ttl = float(os.getenv("stats_cache_ttl", "30"))
+stats_max_days = int(os.getenv("stats_max_days", "90"))
+
+# Сколько последних id сообщений бота хранить на пользователя для последующего удаления
+last_messages_cap = int(os.getenv("last_messages_cap", "50"))
+
+# Метрики в формате Prometheus: http://metrics_host:metrics_port/metrics (0 — выключено)
+metrics_host = os.getenv("metrics_host", "127.0.0.1")
+metrics_port = int(os.getenv("metrics_port", "9100"))
+
+# Защита от флуда: апдейтов в секунду на пользователя, запас, окно повторов (сек), пользователей в памяти
+throttle_rate = float(os.getenv("throttle_rate", "1"))
+throttle_burst = int(os.getenv("throttle_burst", "5"))
+throttle_dedup_window = float(os.getenv("throttle_dedup_window", "2"))
+throttle_max_users = int(os.getenv("throttle_max_users", "100000"))
+
+# Пул соединений PostgreSQL
+db_pool_min_size = int(os.getenv("db_pool_min_size", "10"))  # соединений в простое
+db_pool_max_size = int(os.getenv("db_pool_max_size", "200"))  # предел под нагрузкой
+db_statement_cache_size = int(os.getenv("db_statement_cache_size", "100"))  # prepared statements на соединение
+db_max_queries = int(os.getenv("db_max_queries", "50000"))  # запросов до пересоздания соединения
+db_max_inactive_lifetime = float(os.getenv("db_max_inactive_lifetime", "300"))  # секунд простоя до закрытия
+db_health_interval = float(os.getenv("db_health_interval", "30"))  # секунд между проверками (0 — выключено)
+
+# Реплика для чтения (если не задана, всё идёт на основной сервер)
+replica_host = os.getenv("replica_host")
+replica_port = os.getenv("replica_port")
+
+# Поиск клиентов админом: результатов на странице
+search_page_size = int(os.getenv("search_page_size", "8"))
+
+# Импорт клиентов из CSV/XLSX: строк в одной пачке COPY
+import_chunk_size = int(os.getenv("import_chunk_size", "5000"))
+
+# Рассылки: получателей в пачке и секунд аренды кампании процессом
+broadcast_batch_size = int(os.getenv("broadcast_batch_size", "100"))
+broadcast_lease = int(os.getenv("broadcast_lease", "60"))
+
+# Логи: файл с ротацией по размеру или по времени (log_rotate_when, например 'midnight')
+log_file = os.getenv("log_file", "app.log")
+log_level = os.getenv("log_level", "WARNING")
+log_max_bytes = int(os.getenv("log_max_bytes", str(10 * 1024 * 1024)))
+log_backup_count = int(os.getenv("log_backup_count", "5"))
+log_rotate_when = os.getenv("log_rotate_when") or None
+log_json = os.getenv("log_json", "0") == "1"  # JSON-строки с tg_user_id, хендлером и длительностью
+log_console = os.getenv("log_console", "1") == "1"
+# Повторы из одного места кода: не больше log_rate_burst записей за log_rate_interval секунд (0 — без лимита)
+log_rate_interval = float(os.getenv("log_rate_interval", "60"))
+log_rate_burst = int(os.getenv("log_rate_burst", "5"))
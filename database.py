@@ -1,22 +1,110 @@
 from typing import List
+import asyncio
 import logging
+import re
+import sys
+import time
+from contextlib import asynccontextmanager
 import asyncpg
 from asyncpg.pool import Pool
 
-# logging
-logging.basicConfig(
-    level=logging.WARNING,  # Уровень логирования
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Формат сообщения
-    handlers=[
-        logging.FileHandler("app.log"),  # Запись логов в файл "app.log"
-        logging.StreamHandler()  # Вывод логов на консоль
-    ]
-)
+from metrics import DB_QUERY_SECONDS, DB_QUERY_ERRORS
+
+# logging (настраивается в logging_setup.setup_logging)
 logger = logging.getLogger(__name__)
 
+# Горячие запросы, которые готовятся один раз на каждое соединение пула
+# и дальше выполняются по имени без повторного парсинга/планирования.
+PREPARED_QUERIES = {
+    'user_exists': "SELECT EXISTS(SELECT 1 FROM user_info WHERE tg_user_id = $1)",
+    # Регистрация пользователя (и админа) одним запросом.
+    # Возвращает True, если пользователь был создан этим вызовом.
+    'register_user': """
+        WITH new_user AS (
+            INSERT INTO user_info (tg_user_id, role, last_message_ids)
+            VALUES ($1, $2, ARRAY[]::BIGINT[])
+            ON CONFLICT (tg_user_id) DO NOTHING
+            RETURNING 1
+        ), new_admin AS (
+            INSERT INTO admin_info (tg_user_id)
+            SELECT $1 WHERE $2 = 'admin'
+            ON CONFLICT (tg_user_id) DO NOTHING
+        )
+        SELECT EXISTS(SELECT 1 FROM new_user)
+    """,
+    'get_last_messages': "SELECT last_message_ids FROM user_info WHERE tg_user_id = $1",
+    # Дописывает id в конец массива без сортировки и оставляет только последние $3 элементов
+    'add_last_messages': """
+        UPDATE user_info
+        SET last_message_ids = (COALESCE(last_message_ids, ARRAY[]::bigint[]) || $2::bigint[])[
+            greatest(cardinality(last_message_ids) + cardinality($2::bigint[]) - $3 + 1, 1):
+        ]
+        WHERE tg_user_id = $1
+        RETURNING 1
+    """,
+    'clear_last_messages': """
+        UPDATE user_info
+        SET last_message_ids = ARRAY[]::bigint[]
+        WHERE tg_user_id = $1
+        RETURNING 1
+    """,
+    # Забирает сохранённые id и очищает массив одним запросом
+    'take_last_messages': """
+        UPDATE user_info AS u
+        SET last_message_ids = ARRAY[]::bigint[]
+        FROM (SELECT tg_user_id, last_message_ids FROM user_info WHERE tg_user_id = $1 FOR UPDATE) AS old
+        WHERE u.tg_user_id = old.tg_user_id
+        RETURNING old.last_message_ids
+    """,
+    # Регистрация клиента; если номер был загружен импортом (client_import),
+    # имя и статус берутся оттуда, а строка импорта удаляется — всё одним запросом
+    'client_registration': """
+        WITH imported AS (
+            DELETE FROM client_import WHERE tel_num = $2::varchar
+            RETURNING first_name, last_name, item_status
+        )
+        INSERT INTO client_info (tg_user_id, tel_num, first_name, last_name, item_status)
+        SELECT $1::bigint, $2::varchar, i.first_name, i.last_name, coalesce(i.item_status, 0)
+        FROM (SELECT 1) AS one LEFT JOIN imported AS i ON true
+    """,
+    'get_id_from_phone': "SELECT tg_user_id FROM client_info WHERE tel_num = $1",
+    'change_phone': "UPDATE client_info SET tel_num = $1 WHERE tg_user_id = $2",
+    'get_all_admin_ids': "SELECT tg_user_id FROM admin_info",
+}
+
+# Запросы из PREPARED_QUERIES, которые только читают и могут выполняться на реплике
+READ_ONLY_QUERIES = {'user_exists', 'get_last_messages', 'get_id_from_phone', 'get_all_admin_ids'}
+
+# Сегмент рассылки: статус изделия и/или диапазон даты регистрации (NULL — без фильтра)
+SEGMENT_CONDITION = """
+    ($1::int IS NULL OR item_status = $1)
+    AND ($2::date IS NULL OR reg_date >= $2)
+    AND ($3::date IS NULL OR reg_date <= $3)
+"""
+
+# Счётчики дневного лимита уведомлений: их пишет сам бот, триггер client_update на них не смотрит
+QUOTA_COLUMNS = ('notif_count', 'last_notif_date')
+
+
+class PreparedConnection(asyncpg.Connection):
+    # Соединение, которое хранит свои именованные prepared statements.
+    # Пул отдаёт прокси, но атрибуты прокси делегируются этому объекту.
+    async def named_statement(self, name: str):
+        statements = self.__dict__.setdefault('named_statements', {})
+        statement = statements.get(name)
+        if statement is None:
+            statement = await self.prepare(PREPARED_QUERIES[name], name=f"jw_{name}")
+            statements[name] = statement
+        return statement
+
+    def forget_statement(self, name: str):
+        self.__dict__.get('named_statements', {}).pop(name, None)
+
 
 class AsyncDatabase:
-    def __init__(self, db_name, user, password, host='localhost', port=5432, min_size=10, max_size=200):
+    def __init__(self, db_name, user, password, host='localhost', port=5432, min_size=10, max_size=200,
+                 last_messages_cap=50, statement_cache_size=100, max_queries=50000,
+                 max_inactive_lifetime=300.0, replica_host=None, replica_port=None, health_interval=30.0):
         self.db_name = db_name
         self.user = user
         self.password = password
@@ -25,67 +113,222 @@ class AsyncDatabase:
         self.pool: Pool = None
         self.min_size = min_size
         self.max_size = max_size
+        # Пул растёт до max_size под нагрузкой, а простаивающие дольше max_inactive_lifetime
+        # соединения закрываются — в простое остаётся min_size соединений
+        self.statement_cache_size = statement_cache_size
+        self.max_queries = max_queries  # соединение пересоздаётся после стольких запросов
+        self.max_inactive_lifetime = max_inactive_lifetime
+        self.last_messages_cap = last_messages_cap  # сколько id сообщений хранить на пользователя
+        self.pool_waiting = 0
+
+        # Реплика для чтения (необязательно): туда уходят только запросы с read_only
+        self.replica_host = replica_host
+        self.replica_port = replica_port or port
+        self.replica_pool: Pool = None
+        self.replica_healthy = False
+
+        self.health_interval = health_interval
+        self._health_task = None
 
     # ----------helping_methods-------------
+    async def _create_pool(self, host, port):
+        return await asyncpg.create_pool(
+            database=self.db_name,
+            user=self.user,
+            password=self.password,
+            host=host,
+            port=port,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+            max_queries=self.max_queries,
+            max_inactive_connection_lifetime=self.max_inactive_lifetime,
+            connection_class=PreparedConnection
+        )
+
     async def connect(self):
         try:
-            self.pool = await asyncpg.create_pool(
-                database=self.db_name,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port,
-                min_size=self.min_size,
-                max_size=self.max_size
-            )
+            self.pool = await self._create_pool(self.host, self.port)
             print("[DB] Connection to the database was successfully established")
         except Exception as e:
             print(f"[DB] Error when connecting to the database: {e}")
-            logger.error("Ошибка при подключении к базе данных:", e)
+            logger.error(f"Ошибка при подключении к базе данных: {e}")
+        if self.replica_host:
+            try:
+                self.replica_pool = await self._create_pool(self.replica_host, self.replica_port)
+                self.replica_healthy = True
+            except Exception as e:
+                logger.error(f"Ошибка при подключении к реплике {self.replica_host}: {e}")
+        if self.health_interval and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_forever())
 
     async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        if self.replica_pool:
+            await self.replica_pool.close()
         if self.pool:
             await self.pool.close()
             print("[DB] The connection to the database is closed.")
 
+    # Отдельное соединение вне пула (для LISTEN) с теми же параметрами, что и у основного пула
+    async def connect_listener(self):
+        return await asyncpg.connect(
+            database=self.db_name,
+            user=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+        )
+
+    # Проверка пула: SELECT 1 на соединении из пула. Битые соединения сбрасываются,
+    # пул, который не удалось создать при старте, создаётся заново.
+    async def _check_pool(self, pool, host, port, timeout: float = 5):
+        if pool is None:
+            return await self._create_pool(host, port)
+        try:
+            async with pool.acquire(timeout=timeout) as connection:
+                await connection.fetchval("SELECT 1", timeout=timeout)
+        except Exception:
+            await pool.expire_connections()
+            raise
+        return pool
+
+    async def _health_forever(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                self.pool = await self._check_pool(self.pool, self.host, self.port)
+            except Exception as e:
+                logger.error(f"Проверка соединения с базой не прошла: {e}")
+            if self.replica_host:
+                try:
+                    self.replica_pool = await self._check_pool(self.replica_pool, self.replica_host, self.replica_port)
+                    if not self.replica_healthy:
+                        logger.warning(f"Реплика {self.replica_host} снова доступна")
+                    self.replica_healthy = True
+                except Exception as e:
+                    if self.replica_healthy:
+                        logger.error(f"Реплика {self.replica_host} недоступна, чтение идёт с основного сервера: {e}")
+                    self.replica_healthy = False
+
+    # Соединение из пула с учётом тех, кто ждёт свободного соединения (для метрик)
+    # read_only=True отправляет запрос на реплику, если она есть и прошла последнюю проверку
+    @asynccontextmanager
+    async def _acquire(self, read_only: bool = False):
+        pool = self.replica_pool if read_only and self.replica_healthy else self.pool
+        self.pool_waiting += 1
+        waiting = True
+        try:
+            async with pool.acquire() as connection:
+                self.pool_waiting -= 1
+                waiting = False
+                yield connection
+        finally:
+            if waiting:
+                self.pool_waiting -= 1
+
+    # Время запроса пишется в метрику с меткой — именем метода AsyncDatabase, который его вызвал
+    @staticmethod
+    def _observe(label: str, started: float, failed: bool):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, label)
+        if failed:
+            DB_QUERY_ERRORS.inc(label)
+
     # Этот метод выполняет SQL-запрос на изменение данных (например, INSERT, UPDATE, DELETE).
     # Метод принимает SQL-запрос как строку и параметры для подстановки в запрос.
     # Он использует пул соединений для выполнения запроса и открывает транзакцию для обеспечения атомарности операций.
     async def execute(self, query: str, *args):
-        async with self.pool.acquire() as connection:
-            async with connection.transaction():
-                await connection.execute(query, *args)
+        label, started, failed = sys._getframe(1).f_code.co_name, time.perf_counter(), True
+        try:
+            async with self._acquire() as connection:
+                async with connection.transaction():
+                    result = await connection.execute(query, *args)
+            failed = False
+            return result
+        finally:
+            self._observe(label, started, failed)
+
+    # Чтение одним запросом не нуждается в явной транзакции:
+    # BEGIN/COMMIT были бы двумя лишними обращениями к серверу.
+
+    # fetch* с read_only=True можно отправлять на реплику; без флага запрос идёт на основной сервер,
+    # так как часть запросов через fetch* пишет (UPDATE ... RETURNING).
 
     # Этот метод выполняет SQL-запрос, который возвращает несколько строк данных.
     # Он принимает SQL-запрос и параметры для подстановки.
     # Метод возвращает результат в виде списка строк (каждая строка представляет собой запись в таблице).
-    async def fetch(self, query: str, *args):
-        async with self.pool.acquire() as connection:
-            async with connection.transaction():
-                return await connection.fetch(query, *args)
+    async def fetch(self, query: str, *args, read_only: bool = False):
+        label, started, failed = sys._getframe(1).f_code.co_name, time.perf_counter(), True
+        try:
+            async with self._acquire(read_only) as connection:
+                result = await connection.fetch(query, *args)
+            failed = False
+            return result
+        finally:
+            self._observe(label, started, failed)
 
     # Этот метод выполняет SQL-запрос, который возвращает одну строку данных.
     # Подходит для запросов, которые должны вернуть только одну запись.
     # Метод возвращает одну строку из результата запроса.
-    async def fetchrow(self, query: str, *args):
-        async with self.pool.acquire() as connection:
-            async with connection.transaction():
-                return await connection.fetchrow(query, *args)
+    async def fetchrow(self, query: str, *args, read_only: bool = False):
+        label, started, failed = sys._getframe(1).f_code.co_name, time.perf_counter(), True
+        try:
+            async with self._acquire(read_only) as connection:
+                result = await connection.fetchrow(query, *args)
+            failed = False
+            return result
+        finally:
+            self._observe(label, started, failed)
 
     # Этот метод выполняет SQL-запрос, который возвращает одно значение
     # (например, результат агрегации или значения из одного столбца).
     # Метод принимает индекс столбца для возвращаемого значения.
     # По умолчанию индекс равен 0, что означает первый столбец.
-    async def fetchval(self, query: str, *args, column: int = 0):
-        async with self.pool.acquire() as connection:
-            async with connection.transaction():
-                return await connection.fetchval(query, *args, column=column)
+    async def fetchval(self, query: str, *args, column: int = 0, read_only: bool = False):
+        label, started, failed = sys._getframe(1).f_code.co_name, time.perf_counter(), True
+        try:
+            async with self._acquire(read_only) as connection:
+                result = await connection.fetchval(query, *args, column=column)
+            failed = False
+            return result
+        finally:
+            self._observe(label, started, failed)
+
+    # Выполняет именованный запрос из PREPARED_QUERIES на prepared statement соединения.
+    # method — 'fetch', 'fetchrow' или 'fetchval'. Один запрос = одно обращение к серверу.
+    async def run_prepared(self, method: str, name: str, *args):
+        started, failed = time.perf_counter(), True
+        try:
+            async with self._acquire(name in READ_ONLY_QUERIES) as connection:
+                statement = await connection.named_statement(name)
+                try:
+                    result = await getattr(statement, method)(*args)
+                except asyncpg.exceptions.InvalidCachedStatementError:
+                    # Схема поменялась — готовим запрос заново
+                    connection.forget_statement(name)
+                    statement = await connection.named_statement(name)
+                    result = await getattr(statement, method)(*args)
+            failed = False
+            return result
+        finally:
+            self._observe(name, started, failed)
+
+    # Размер пула для метрик: всего соединений, свободных и ожидающих соединения запросов
+    def pool_stats(self) -> dict:
+        stats = {"size": 0, "idle": 0, "waiting": self.pool_waiting, "max": self.max_size}
+        if self.pool:
+            stats.update(size=self.pool.get_size(), idle=self.pool.get_idle_size())
+        if self.replica_pool:
+            stats.update(replica_size=self.replica_pool.get_size(), replica_idle=self.replica_pool.get_idle_size())
+        return stats
 
     # Есть ли пользователь с тг айди в таблице
     async def user_exists(self, tg_user_id: int) -> bool:
-        query = "SELECT EXISTS(SELECT 1 FROM user_info WHERE tg_user_id = $1)"
         try:
-            result = await self.fetchval(query, tg_user_id)
+            result = await self.run_prepared('fetchval', 'user_exists', tg_user_id)
             return result
         except Exception as e:
             #nt(f"[DB] Ошибка при проверке существования пользователя: {e}")
@@ -96,11 +339,7 @@ class AsyncDatabase:
     # Получение последнего сообщения
     async def get_last_messages_by_user_id(self, tg_user_id: int) -> List[int]:
         try:
-            query = """
-                    SELECT last_message_ids FROM user_info
-                    WHERE tg_user_id = $1;
-                    """
-            last_message = await self.fetchval(query, tg_user_id)
+            last_message = await self.run_prepared('fetchval', 'get_last_messages', tg_user_id)
 
             if last_message is not None:
                 #print(f"[DB] Последнее сообщение для пользователя {tg_user_id}: {last_message}")
@@ -112,6 +351,8 @@ class AsyncDatabase:
             #print(f"[DB] Ошибка при получении последнего сообщения для пользователя {tg_user_id}: {e}")
             return []
 
+    # Запись пользователя создаётся в /start (role NOT NULL), поэтому здесь достаточно
+    # одного UPDATE вместо пары «проверка существования + UPDATE/INSERT».
     async def set_last_message_by_user_id(self, tg_user_id, last_message):
         try:
             if last_message is None:
@@ -122,58 +363,29 @@ class AsyncDatabase:
             if not isinstance(last_message, list):
                 last_message = [last_message]
 
-            exists_query = """
-                SELECT EXISTS(
-                    SELECT 1 FROM user_info WHERE tg_user_id = $1
-                );
-            """
-            exists = await self.fetchval(exists_query, tg_user_id)
-
-            if exists:
-                # Обновляем массив, добавляя новые значения
-                update_query = """
-                    UPDATE user_info
-                    SET last_message_ids = ARRAY(
-                        SELECT unnest(last_message_ids) 
-                        UNION 
-                        SELECT unnest($2::bigint[])
-                    )
-                    WHERE tg_user_id = $1;
-                """
-                await self.execute(update_query, tg_user_id, last_message)
-                #print(f"[DB] Последнее сообщение для пользователя {tg_user_id} обновлено")
-            else:
-                # Вставляем новые значения в массив
-                insert_query = """
-                    INSERT INTO user_info (tg_user_id, last_message_ids)
-                    VALUES ($1, $2);
-                """
-                await self.execute(insert_query, tg_user_id, last_message)
-                #print(f"[DB] Добавлена новая запись для пользователя {tg_user_id} с последним сообщением")
+            updated = await self.run_prepared(
+                'fetchval', 'add_last_messages', tg_user_id, last_message, self.last_messages_cap
+            )
+            if not updated:
+                logger.error(f"[DB] Пользователь {tg_user_id} не найден, сообщение не сохранено")
 
         except Exception as e:
             logger.error(f"Ошибка при установке последнего сообщения для пользователя {tg_user_id}: {e}")
             #print(f"Ошибка при установке последнего сообщения для пользователя {tg_user_id}: {e}")
 
+    # Возвращает сохранённые id сообщений и сразу очищает массив — одно обращение к базе
+    async def take_last_messages_by_user_id(self, tg_user_id: int) -> List[int]:
+        try:
+            last_messages = await self.run_prepared('fetchval', 'take_last_messages', tg_user_id)
+            return last_messages or []
+        except Exception as e:
+            logger.error(f"Ошибка при получении last_message_ids для пользователя {tg_user_id}: {e}")
+            return []
+
     async def clear_last_message_ids_by_user_id(self, tg_user_id):
         try:
-            exists_query = """
-                SELECT EXISTS(
-                    SELECT 1 FROM user_info WHERE tg_user_id = $1
-                );
-            """
-            exists = await self.fetchval(exists_query, tg_user_id)
-
-            if exists:
-                # Очищаем массив
-                update_query = """
-                    UPDATE user_info
-                    SET last_message_ids = ARRAY[]::bigint[]
-                    WHERE tg_user_id = $1;
-                """
-                await self.execute(update_query, tg_user_id)
-                #print(f"[DB] Поле last_message_ids для пользователя {tg_user_id} очищено")
-            else:
+            cleared = await self.run_prepared('fetchval', 'clear_last_messages', tg_user_id)
+            if not cleared:
                 logger.error(f"[DB] Пользователь {tg_user_id} не найден, очистка не требуется")
                 #print(f"[DB] Пользователь {tg_user_id} не найден, очистка не требуется")
 
@@ -184,25 +396,20 @@ class AsyncDatabase:
 #------------user---------
 #-------------------------
 
+    # Регистрирует пользователя и, для админа, запись в admin_info — одним запросом.
+    # Возвращает True, если пользователь новый, и False, если он уже был в базе.
+    async def register_user(self, tg_user_id: int, role: str) -> bool:
+        return await self.run_prepared('fetchval', 'register_user', tg_user_id, role)
+
     async def user_registration(self, tg_user_id: int, role: str):
         try:
-            query = '''
-                INSERT INTO user_info (tg_user_id, role, last_message_ids)
-                VALUES ($1, $2, ARRAY[]::BIGINT[])
-            '''
-            await self.execute(query, tg_user_id, role)
+            await self.register_user(tg_user_id, role)
         except Exception as e:
             logger.error(f"Ошибка при регистрации пользователя {tg_user_id}: {e}")
 
-
-
     async def client_registration(self, tg_user_id, phone_number):
         try:
-            insert_query = """
-                                INSERT INTO client_info (tg_user_id, tel_num)
-                                VALUES ($1, $2);
-                            """
-            await self.execute(insert_query, tg_user_id, phone_number)
+            await self.run_prepared('fetch', 'client_registration', tg_user_id, phone_number)
         except Exception as e:
             logger.error(f"Ошибка при регистрации клиента {tg_user_id}: {e}")
 
@@ -210,25 +417,380 @@ class AsyncDatabase:
         try:
             insert_query = """
                                             INSERT INTO admin_info (tg_user_id)
-                                            VALUES ($1);
+                                            VALUES ($1)
+                                            ON CONFLICT (tg_user_id) DO NOTHING;
                                         """
             await self.execute(insert_query, tg_user_id)
         except Exception as e:
             logger.error(f"Ошибка при регистрации админа {tg_user_id}: {e}")
 
     async def get_id_from_phone(self, phone):
-        query = '''SELECT tg_user_id FROM client_info WHERE tel_num = $1'''
-        client_tg_id = await self.fetchval(query, phone)
+        client_tg_id = await self.run_prepared('fetchval', 'get_id_from_phone', phone)
         return client_tg_id
 
     async def change_phone(self, tg_user_id: int, phone: str):
-        query = '''
-            UPDATE client_info SET tel_num = $1 WHERE tg_user_id = $2;
-        '''
-        await self.execute(query, phone, tg_user_id)
+        await self.run_prepared('fetch', 'change_phone', phone, tg_user_id)
 
     async def get_all_admin_ids(self) -> List[int]:
-        query = "SELECT tg_user_id FROM admin_info;"
-        rows = await self.fetch(query)
+        rows = await self.run_prepared('fetch', 'get_all_admin_ids')
         # rows — список Record, у каждого .get('tg_user_id')
         return [r['tg_user_id'] for r in rows]
+
+#-------------------------
+#------client_search------
+#-------------------------
+    # Поиск клиентов для админа с keyset-пагинацией по tg_user_id: каждая страница — один
+    # запрос по индексу, без OFFSET. after — tg_user_id последней строки предыдущей страницы
+    # (листаем вперёд), before — первой строки текущей (листаем назад).
+    # Что ищем, определяется по тексту запроса:
+    #   "статус 2" / "status:2" — item_status;
+    #   цифры, начинающиеся с 7, — префикс tel_num (btree text_pattern_ops);
+    #   другие цифры — подстрока tel_num (pg_trgm);
+    #   текст — имя/фамилия: от 3 символов подстрока (pg_trgm), короче — префикс фамилии.
+    # Возвращает (строки, есть ли предыдущая страница, есть ли следующая).
+    async def search_clients(self, text: str, after: int = None, before: int = None, limit: int = 8):
+        text = text.strip()
+        status = re.match(r'^(?:статус|status)\s*:?\s*(\d+)$', text, re.IGNORECASE)
+        digits = re.sub(r'[\s()+-]', '', text)
+        pattern = re.sub(r'([%_\\])', r'\\\1', text.lower())  # % и _ из запроса — обычные символы
+        if status:
+            condition, term = "item_status = $1", int(status.group(1))
+        elif digits.isdigit():
+            if digits.startswith('7'):
+                condition, term = "tel_num LIKE $1 || '%'", digits
+            else:
+                condition, term = "tel_num LIKE '%' || $1 || '%'", digits
+        elif len(text) >= 3:
+            condition = "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) LIKE '%' || $1 || '%'"
+            term = pattern
+        else:
+            condition, term = "lower(last_name) LIKE $1 || '%'", pattern
+
+        backward = before is not None
+        args = [term, limit + 1]
+        if backward:
+            condition += " AND tg_user_id < $3"
+            args.append(before)
+        elif after is not None:
+            condition += " AND tg_user_id > $3"
+            args.append(after)
+        query = f'''
+            SELECT tg_user_id, first_name, last_name, tel_num, item_status
+            FROM client_info
+            WHERE {condition}
+            ORDER BY tg_user_id {'DESC' if backward else 'ASC'}
+            LIMIT $2
+        '''
+        rows = await self.fetch(query, *args, read_only=True)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            return list(reversed(rows)), more, True
+        return rows, after is not None, more
+
+    async def get_client(self, tg_user_id: int):
+        query = '''
+            SELECT tg_user_id, first_name, last_name, tel_num, item_status
+            FROM client_info WHERE tg_user_id = $1
+        '''
+        return await self.fetchrow(query, tg_user_id, read_only=True)
+
+#-------------------------
+#------client_import------
+#-------------------------
+    # Массовый импорт клиентов. chunks — итератор пачек записей
+    # (line_no, tel_num, first_name, last_name, item_status); пачки по очереди уходят
+    # через COPY во временную таблицу, так что в памяти одновременно лежит одна пачка.
+    # Затем одной транзакцией: существующие клиенты с этими номерами обновляются,
+    # остальные номера попадают в client_import (ON CONFLICT по tel_num) и будут
+    # привязаны к клиенту при его регистрации в боте.
+    # on_progress(строк загружено) вызывается после каждой пачки.
+    # Возвращает (обновлено клиентов, номеров ожидают регистрации).
+    async def import_clients(self, chunks, columns, on_progress=None):
+        async with self._acquire() as connection:
+            async with connection.transaction():
+                await connection.execute('''
+                    CREATE TEMP TABLE client_import_staging (
+                        line_no     INT,
+                        tel_num     VARCHAR(13),
+                        first_name  VARCHAR(100),
+                        last_name   VARCHAR(100),
+                        item_status INT
+                    ) ON COMMIT DROP
+                ''')
+                loaded = 0
+                for chunk in chunks:
+                    await connection.copy_records_to_table('client_import_staging', records=chunk, columns=columns)
+                    loaded += len(chunk)
+                    if on_progress:
+                        await on_progress(loaded)
+
+                # Если номер встречается в файле несколько раз, побеждает последняя строка
+                await connection.execute('''
+                    CREATE TEMP TABLE client_import_latest ON COMMIT DROP AS
+                    SELECT DISTINCT ON (tel_num) tel_num, first_name, last_name, item_status
+                    FROM client_import_staging
+                    ORDER BY tel_num, line_no DESC
+                ''')
+                updated = await connection.fetchval('''
+                    WITH updated AS (
+                        UPDATE client_info AS c
+                        SET first_name = coalesce(s.first_name, c.first_name),
+                            last_name = coalesce(s.last_name, c.last_name),
+                            item_status = coalesce(s.item_status, c.item_status)
+                        FROM client_import_latest AS s
+                        WHERE c.tel_num = s.tel_num
+                        RETURNING 1
+                    )
+                    SELECT count(*) FROM updated
+                ''')
+                pending = await connection.fetchval('''
+                    WITH upserted AS (
+                        INSERT INTO client_import (tel_num, first_name, last_name, item_status)
+                        SELECT s.tel_num, s.first_name, s.last_name, s.item_status
+                        FROM client_import_latest AS s
+                        WHERE NOT EXISTS (SELECT 1 FROM client_info AS c WHERE c.tel_num = s.tel_num)
+                        ON CONFLICT (tel_num) DO UPDATE
+                        SET first_name = coalesce(EXCLUDED.first_name, client_import.first_name),
+                            last_name = coalesce(EXCLUDED.last_name, client_import.last_name),
+                            item_status = coalesce(EXCLUDED.item_status, client_import.item_status),
+                            imported_at = now()
+                        RETURNING 1
+                    )
+                    SELECT count(*) FROM upserted
+                ''')
+        return updated, pending
+
+#-------------------------
+#-------broadcast---------
+#-------------------------
+    async def count_recipients(self, item_status=None, reg_from=None, reg_to=None) -> int:
+        query = f"SELECT count(*) FROM client_info WHERE {SEGMENT_CONDITION}"
+        return await self.fetchval(query, item_status, reg_from, reg_to, read_only=True)
+
+    # Создаёт кампанию в состоянии running; total — число получателей на момент создания
+    async def create_campaign(self, created_by: int, text: str, photo_file_id, item_status=None,
+                              reg_from=None, reg_to=None):
+        query = f'''
+            INSERT INTO broadcast_campaign
+                (created_by, text, photo_file_id, item_status, reg_from, reg_to, total)
+            SELECT $4::bigint, $5::text, $6::text, $1, $2, $3, count(*)
+            FROM client_info WHERE {SEGMENT_CONDITION}
+            RETURNING *
+        '''
+        return await self.fetchrow(query, item_status, reg_from, reg_to, created_by, text, photo_file_id)
+
+    async def get_campaign(self, campaign_id: int):
+        return await self.fetchrow("SELECT * FROM broadcast_campaign WHERE id = $1", campaign_id)
+
+    async def list_campaigns(self, limit: int = 5):
+        return await self.fetch("SELECT * FROM broadcast_campaign ORDER BY id DESC LIMIT $1", limit)
+
+    # Берёт запущенную кампанию в аренду на lease секунд: отправляет её только арендатор (owner).
+    # campaign_id=None — любые запущенные кампании, чья аренда истекла (восстановление после сбоя).
+    async def claim_campaigns(self, lease: int, owner: str, campaign_id: int = None):
+        query = '''
+            UPDATE broadcast_campaign AS b
+            SET locked_until = now() + make_interval(secs => $1), lease_owner = $3
+            FROM (
+                SELECT id FROM broadcast_campaign
+                WHERE state = 'running'
+                  AND ($2::bigint IS NULL OR id = $2)
+                  AND (locked_until IS NULL OR locked_until < now())
+                FOR UPDATE SKIP LOCKED
+            ) AS free
+            WHERE b.id = free.id
+            RETURNING b.*
+        '''
+        return await self.fetch(query, lease, campaign_id, owner)
+
+    # Следующая пачка получателей после курсора (keyset по первичному ключу client_info)
+    async def get_campaign_recipients(self, campaign, after: int, limit: int) -> List[int]:
+        query = f'''
+            SELECT tg_user_id FROM client_info
+            WHERE tg_user_id > $4 AND {SEGMENT_CONDITION}
+            ORDER BY tg_user_id
+            LIMIT $5
+        '''
+        rows = await self.fetch(
+            query, campaign['item_status'], campaign['reg_from'], campaign['reg_to'], after, limit, read_only=True
+        )
+        return [r['tg_user_id'] for r in rows]
+
+    # Подтверждает отправленную пачку: сдвигает курсор и продлевает аренду.
+    # Возвращает текущее состояние кампании — так арендатор узнаёт о паузе или отмене;
+    # None — аренду уже забрал другой процесс, и эта пачка не подтверждается.
+    async def ack_campaign(self, campaign_id: int, owner: str, cursor: int, sent: int, failed: int, lease: int):
+        query = '''
+            UPDATE broadcast_campaign
+            SET cursor = $2, sent = sent + $3, failed = failed + $4,
+                locked_until = now() + make_interval(secs => $5), updated_at = now()
+            WHERE id = $1 AND lease_owner = $6
+            RETURNING state
+        '''
+        return await self.fetchval(query, campaign_id, cursor, sent, failed, lease, owner)
+
+    # Продлевает аренду во время отправки пачки; False — аренда потеряна
+    async def renew_campaign(self, campaign_id: int, owner: str, lease: int) -> bool:
+        query = '''
+            UPDATE broadcast_campaign
+            SET locked_until = now() + make_interval(secs => $3)
+            WHERE id = $1 AND lease_owner = $2
+            RETURNING id
+        '''
+        return await self.fetchval(query, campaign_id, owner, lease) is not None
+
+    # Снимает аренду (только свою); при finished=True запущенная кампания помечается завершённой
+    async def release_campaign(self, campaign_id: int, owner: str, finished: bool = False):
+        query = '''
+            UPDATE broadcast_campaign
+            SET locked_until = NULL, lease_owner = NULL, updated_at = now(),
+                state = CASE WHEN $2 AND state = 'running' THEN 'done' ELSE state END
+            WHERE id = $1 AND lease_owner = $3
+            RETURNING *
+        '''
+        return await self.fetchrow(query, campaign_id, finished, owner)
+
+    # Пауза, продолжение и отмена: переход разрешён только из указанных состояний
+    async def set_campaign_state(self, campaign_id: int, state: str, allowed_from: List[str]):
+        query = '''
+            UPDATE broadcast_campaign SET state = $2, updated_at = now()
+            WHERE id = $1 AND state = ANY($3::text[])
+            RETURNING *
+        '''
+        return await self.fetchrow(query, campaign_id, state, allowed_from)
+
+#-------------------------
+#----------stats----------
+#-------------------------
+    # Сводка для админа из таблиц, которые ведут триггеры (см. SQL_code_refresh.txt):
+    # итоги (day = NULL) и значения по дням начиная с day_from — одним запросом
+    async def get_stats(self, day_from):
+        query = '''
+            SELECT NULL::date AS day, metric, value FROM stats_total
+            UNION ALL
+            SELECT day, metric, value FROM stats_daily WHERE day >= $1
+        '''
+        return await self.fetch(query, day_from, read_only=True)
+
+#-------------------------
+#-------photo_cache-------
+#-------------------------
+    async def get_photo_cache_entry(self, path: str):
+        query = '''
+            SELECT mtime_ns, size, content_hash, file_id FROM photo_file_cache
+            WHERE path = $1
+        '''
+        return await self.fetchrow(query, path, read_only=True)
+
+    async def get_photo_file_id_by_hash(self, content_hash: str):
+        query = '''SELECT file_id FROM photo_file_cache WHERE content_hash = $1 LIMIT 1'''
+        return await self.fetchval(query, content_hash, read_only=True)
+
+    async def save_photo_cache_entry(self, path: str, mtime_ns: int, size: int, content_hash: str, file_id: str):
+        try:
+            query = '''
+                INSERT INTO photo_file_cache (path, mtime_ns, size, content_hash, file_id)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (path) DO UPDATE
+                SET mtime_ns = EXCLUDED.mtime_ns,
+                    size = EXCLUDED.size,
+                    content_hash = EXCLUDED.content_hash,
+                    file_id = EXCLUDED.file_id,
+                    updated_at = now();
+            '''
+            await self.execute(query, path, mtime_ns, size, content_hash, file_id)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении file_id для {path}: {e}")
+
+    async def delete_photo_cache_entry(self, path: str):
+        query = '''DELETE FROM photo_file_cache WHERE path = $1'''
+        await self.execute(query, path)
+
+#-------------------------
+#-------notif_quota-------
+#-------------------------
+    async def get_notif_counter(self, tg_user_id: int):
+        query = "SELECT notif_count, last_notif_date FROM client_info WHERE tg_user_id = $1"
+        return await self.fetchrow(query, tg_user_id)
+
+    # Добавляет приросты счётчиков уведомлений пачкой (каждый клиент — не больше раза в пачке).
+    # Прирост за новый день начинает счётчик заново, за уже прошедший день — не учитывается.
+    # Меняются только notif_count и last_notif_date, на которые триггер client_update
+    # не срабатывает (см. QUOTA_COLUMNS)
+    async def save_notif_counters(self, tg_user_ids: List[int], deltas: List[int], days: list):
+        query = '''
+            UPDATE client_info AS c
+            SET notif_count = CASE WHEN c.last_notif_date = u.day THEN coalesce(c.notif_count, 0) + u.delta
+                                   ELSE u.delta END,
+                last_notif_date = u.day
+            FROM unnest($1::bigint[], $2::int[], $3::date[]) AS u(tg, delta, day)
+            WHERE c.tg_user_id = u.tg
+              AND (c.last_notif_date IS NULL OR c.last_notif_date <= u.day)
+        '''
+        await self.execute(query, tg_user_ids, deltas, days)
+
+#-------------------------
+#---client_update_outbox--
+#-------------------------
+    # Забирает пачку недоставленных изменений и берёт их в аренду на lease секунд.
+    # SKIP LOCKED позволяет нескольким процессам разбирать outbox, не мешая друг другу.
+    async def claim_client_updates(self, batch_size: int, lease: int):
+        query = '''
+            UPDATE client_update_outbox AS o
+            SET locked_until = now() + make_interval(secs => $2)
+            FROM (
+                SELECT id FROM client_update_outbox
+                WHERE delivered_at IS NULL
+                  AND (locked_until IS NULL OR locked_until < now())
+                ORDER BY id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            ) AS batch
+            WHERE o.id = batch.id
+            RETURNING o.id, o.tg_user_id, o.payload
+        '''
+        rows = await self.fetch(query, batch_size, lease)
+        # RETURNING не сохраняет порядок подзапроса
+        return sorted(rows, key=lambda r: r['id'])
+
+    async def ack_client_updates(self, ids: List[int]):
+        query = '''
+            UPDATE client_update_outbox SET delivered_at = now()
+            WHERE id = ANY($1::bigint[])
+        '''
+        await self.execute(query, ids)
+
+    async def purge_client_updates(self, keep_days: int):
+        query = '''
+            DELETE FROM client_update_outbox
+            WHERE delivered_at < now() - make_interval(days => $1)
+        '''
+        await self.execute(query, keep_days)
+
+    # Пересоздаёт триггер client_update так, чтобы он срабатывал только на указанные столбцы.
+    # Список передаётся в функцию триггера через TG_ARGV; если он не изменился, ничего не делаем.
+    async def sync_client_update_trigger(self, columns: List[str]):
+        try:
+            for column in columns:
+                if not re.match(r'^[a-z_][a-z0-9_]*$', column):
+                    raise ValueError(f"Недопустимое имя столбца: {column!r}")
+                if column in QUOTA_COLUMNS:
+                    # Бот сам пишет эти столбцы — уведомление о них зациклило бы отправку
+                    raise ValueError(f"Столбец {column!r} нельзя наблюдать триггером")
+            current = await self.fetchval(
+                "SELECT tgargs FROM pg_trigger WHERE tgname = 'client_info_after_update' AND NOT tgisinternal"
+            )
+            if current is not None and [a.decode() for a in current.split(b'\x00')[:-1]] == list(columns):
+                return
+            query = f"""
+                DROP TRIGGER IF EXISTS client_info_after_update ON client_info;
+                CREATE TRIGGER client_info_after_update
+                  AFTER UPDATE OF {', '.join(columns)} ON client_info
+                  FOR EACH ROW
+                  EXECUTE FUNCTION notify_client_update({', '.join(f"'{c}'" for c in columns)});
+            """
+            await self.execute(query)
+            logger.warning(f"Триггер client_info_after_update пересоздан для столбцов {columns}")
+        except Exception as e:
+            logger.error(f"Не удалось обновить триггер client_info_after_update: {e}")
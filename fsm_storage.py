@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+logger = logging.getLogger(__name__)
+
+UPSERT_QUERY = """
+    INSERT INTO fsm_storage (bot_id, chat_id, user_id, state, data)
+    SELECT b, c, u, s, d::jsonb
+    FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[], $5::text[]) AS t(b, c, u, s, d)
+    ON CONFLICT (bot_id, chat_id, user_id) DO UPDATE
+    SET state = EXCLUDED.state,
+        data = EXCLUDED.data,
+        updated_at = now();
+"""
+
+DELETE_QUERY = """
+    DELETE FROM fsm_storage AS f
+    USING unnest($1::bigint[], $2::bigint[], $3::bigint[]) AS t(b, c, u)
+    WHERE f.bot_id = t.b AND f.chat_id = t.c AND f.user_id = t.u;
+"""
+
+
+class PostgresStorage(BaseStorage):
+    # FSM-хранилище aiogram в таблице fsm_storage на общем пуле AsyncDatabase.
+    # Чтения идут через локальный кэш, записи копятся в памяти и сбрасываются
+    # одним пакетным UPSERT: в конце обработки апдейта (flush из middleware)
+    # или по таймеру flush_delay. Пара set_state + update_data в хендлере даёт одну запись.
+    # Кэш корректен, пока апдейты одного пользователя обрабатывает один процесс.
+    def __init__(self, database, cache_size: int = 10000, flush_delay: float = 0.5):
+        self.database = database
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay
+        self._cache: OrderedDict = OrderedDict()  # (bot, chat, user) -> [state, data]
+        self._dirty: set = set()
+        self._flush_handle = None
+        self._flush_lock = asyncio.Lock()
+
+        # Счётчики
+        self.reads = 0
+        self.writes = 0
+
+    # ----------helping_methods-------------
+    @staticmethod
+    def _key(key: StorageKey) -> tuple:
+        return key.bot_id, key.chat_id, key.user_id
+
+    def _evict(self):
+        # Вытесняем только уже сохранённые записи
+        while len(self._cache) > self.cache_size:
+            for k in self._cache:
+                if k not in self._dirty:
+                    del self._cache[k]
+                    break
+            else:
+                return
+
+    async def _entry(self, key: StorageKey) -> list:
+        k = self._key(key)
+        entry = self._cache.get(k)
+        if entry is not None:
+            self._cache.move_to_end(k)
+            return entry
+        row = await self.database.fetchrow(
+            "SELECT state, data FROM fsm_storage WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3",
+            *k
+        )
+        self.reads += 1
+        entry = self._cache.get(k)  # пока ждали базу, запись могла появиться
+        if entry is None:
+            entry = [row['state'], json.loads(row['data'])] if row else [None, {}]
+            self._cache[k] = entry
+            self._evict()
+        return entry
+
+    def _mark_dirty(self, key: StorageKey):
+        self._dirty.add(self._key(key))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_delay, lambda: asyncio.ensure_future(self.flush()))
+
+    # Сбрасывает все изменённые ключи в базу пакетом
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for k in dirty:
+                state, data = self._cache.get(k, (None, {}))
+                if state is None and not data:
+                    deletes.append(k)
+                else:
+                    upserts.append((*k, state, json.dumps(data, ensure_ascii=False)))
+            try:
+                if upserts:
+                    await self.database.execute(UPSERT_QUERY, *map(list, zip(*upserts)))
+                    self.writes += 1
+                if deletes:
+                    await self.database.execute(DELETE_QUERY, *map(list, zip(*deletes)))
+                    self.writes += 1
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении FSM-состояний: {e}")
+                self._dirty |= dirty
+                self._schedule_flush()
+
+    # ----------BaseStorage-------------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._entry(key)
+        return entry[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry[1] = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._entry(key)
+        return entry[1].copy()
+
+    async def close(self) -> None:
+        await self.flush()
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    # Внешний middleware апдейтов: после хендлера сохраняет накопленные изменения FSM
+    def __init__(self, storage: PostgresStorage):
+        self.storage = storage
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            await self.storage.flush()
@@ -0,0 +1,145 @@
+import ast
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'identity_change'
+
+
+def parse_admin_ids(raw) -> frozenset:
+    # admin_tg_ids в .env записан как python-список: "[123, 456]"
+    try:
+        return frozenset(int(x) for x in ast.literal_eval((raw or "[]").strip()))
+    except Exception:
+        return frozenset()
+
+
+class IdentityCache:
+    # Кэш ролей, админов и известных пользователей в памяти процесса.
+    # Загружается целиком при старте, дальше поддерживается уведомлениями
+    # триггеров user_info/admin_info (канал identity_change).
+    # Если соединение слушателя потеряно, данные считаются свежими ещё ttl секунд,
+    # после чего перечитываются из базы при следующем обращении.
+    def __init__(self, database, connect, configured_admins=None, ttl: float = 60):
+        self.database = database
+        self.connect = connect  # корутина-фабрика отдельного соединения для LISTEN
+        self.configured_admins = parse_admin_ids(configured_admins)
+        self.ttl = ttl
+
+        self.roles: dict = {}      # tg_user_id -> 'client' | 'admin'
+        self.admin_ids: set = set()  # содержимое admin_info
+
+        self._listening = False
+        self._loaded_at = 0.0
+        self._reload_lock = asyncio.Lock()
+        self._task: asyncio.Task = None
+
+    # ----------helping_methods-------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen_forever())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    @property
+    def listening(self) -> bool:
+        return self._listening
+
+    async def reload(self):
+        users = await self.database.fetch("SELECT tg_user_id, role FROM user_info")
+        admins = await self.database.fetch("SELECT tg_user_id FROM admin_info")
+        self.roles = {r['tg_user_id']: r['role'] for r in users}
+        self.admin_ids = {r['tg_user_id'] for r in admins}
+        self._loaded_at = time.monotonic()
+
+    # Перечитывает кэш, только если слушатель отвалился и TTL истёк
+    async def ensure_fresh(self):
+        if self._listening or time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._reload_lock:
+            if time.monotonic() - self._loaded_at >= self.ttl:
+                try:
+                    await self.reload()
+                except Exception as e:
+                    logger.error(f"Не удалось обновить кэш пользователей: {e}")
+
+    # ----------lookups-------------
+    def is_configured_admin(self, tg_user_id: int) -> bool:
+        return tg_user_id in self.configured_admins
+
+    def user_known(self, tg_user_id: int) -> bool:
+        return tg_user_id in self.roles
+
+    def role(self, tg_user_id: int):
+        return self.roles.get(tg_user_id)
+
+    def get_admin_ids(self) -> list:
+        return list(self.admin_ids)
+
+    # Локально учитывает то, что бот только что сам записал в базу
+    def remember_user(self, tg_user_id: int, role: str):
+        self.roles[tg_user_id] = role
+        if role == 'admin':
+            self.admin_ids.add(tg_user_id)
+
+    # ----------listener-------------
+    def _on_notify(self, _conn, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+            tg = int(data['tg_user_id'])
+            if data['table'] == 'user_info':
+                if data['op'] == 'DELETE':
+                    self.roles.pop(tg, None)
+                else:
+                    self.roles[tg] = data.get('role')
+            elif data['table'] == 'admin_info':
+                if data['op'] == 'DELETE':
+                    self.admin_ids.discard(tg)
+                else:
+                    self.admin_ids.add(tg)
+        except Exception as e:
+            logger.error("Identity notify error: %s", e)
+
+    async def _listen_forever(self):
+        delay = 1
+        while True:
+            conn = None
+            try:
+                conn = await self.connect()
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: lost.set())
+                await conn.add_listener(CHANNEL, self._on_notify)
+                # Подписка есть — перечитываем всё, чтобы не потерять изменения за время простоя
+                await self.reload()
+                self._listening = True
+                delay = 1
+                # Периодический пинг с таймаутом, чтобы заметить «тихо» умершее соединение
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), timeout=self.ttl / 2)
+                    except asyncio.TimeoutError:
+                        try:
+                            await conn.fetchval("SELECT 1", timeout=self.ttl / 2)
+                        except asyncio.TimeoutError:
+                            break
+                logger.warning("Соединение слушателя identity_change потеряно, переподключение...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Identity listener error: {e}. Reconnecting in {delay}s...")
+            finally:
+                self._listening = False
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await conn.close(timeout=5)
+                    except Exception:
+                        conn.terminate()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from photo_cache import file_hash
+
+try:
+    from PIL import Image, ImageOps  # из requirements.txt; если не установлен, фото отправляются как есть
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+# Выполняется в процессе пула: уменьшает фото до max_side по большей стороне
+# (с учётом поворота из EXIF) и пересжимает в JPEG
+def make_derivative(src: str, dst: str, max_side: int, quality: int) -> int:
+    with Image.open(src) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        image.save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True)
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+class ImagePreprocessor:
+    # Подготовка фото перед загрузкой в Telegram.
+    # Большие снимки с телефона уменьшаются и пересжимаются в пуле процессов, event loop не ждёт.
+    # Результат кладётся в cache_dir под именем из хэша исходника и параметров,
+    # поэтому один и тот же файл обрабатывается один раз. Если Pillow не установлен
+    # или файл не читается как изображение, отправляется исходный файл.
+    # Каталог ограничен max_cache_bytes: при превышении удаляются файлы, которые дольше всех
+    # не отправлялись (mtime обновляется при каждом попадании), пока не останется 90% лимита.
+    def __init__(self, cache_dir: str = 'image_cache', max_side: int = 2560, quality: int = 85,
+                 workers: int = 2, min_bytes: int = 300 * 1024, max_cache_bytes: int = 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.max_side = max_side
+        self.quality = quality
+        self.workers = workers
+        self.min_bytes = min_bytes  # файлы меньше этого размера не трогаем
+        self._pool = None
+        self._hashes: dict = {}  # (path, mtime_ns, size) -> хэш содержимого
+        self._pending: dict = {}  # путь производного файла -> future обработки
+        self._cache_bytes = None  # размер каталога; считается при первой обработке
+        self._trimming = None
+
+        # Счётчики
+        self.converted = 0
+        self.cached = 0
+        self.evicted = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    # ----------helping_methods-------------
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _cache_files(self) -> list:
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.jpg'):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        return files
+
+    # Выполняется в потоке: удаляет самые старые файлы, пока каталог больше 90% лимита
+    def _trim(self) -> int:
+        files = sorted(self._cache_files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_cache_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evicted += 1
+        return total
+
+    async def _account(self, size: int):
+        if not self.max_cache_bytes:
+            return
+        if self._cache_bytes is None:
+            files = await asyncio.to_thread(self._cache_files)
+            self._cache_bytes = sum(size for _, size, _ in files)
+        else:
+            self._cache_bytes += size
+        if self._cache_bytes > self.max_cache_bytes and self._trimming is None:
+            self._trimming = asyncio.ensure_future(asyncio.to_thread(self._trim))
+            try:
+                self._cache_bytes = await asyncio.shield(self._trimming)
+            except Exception as e:
+                logger.warning(f"Не удалось очистить {self.cache_dir}: {e}")
+            finally:
+                self._trimming = None
+
+    async def _hash(self, path: str, st) -> str:
+        key = (path, st.st_mtime_ns, st.st_size)
+        content_hash = self._hashes.get(key)
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(file_hash, path)
+            if len(self._hashes) > 10000:
+                self._hashes.clear()
+            self._hashes[key] = content_hash
+        return content_hash
+
+    # Путь к файлу, который нужно загрузить вместо path
+    async def prepare(self, path: str) -> str:
+        if not self.enabled or not os.path.exists(path):
+            return path
+        st = os.stat(path)
+        if st.st_size < self.min_bytes:
+            return path
+
+        content_hash = await self._hash(path, st)
+        dst = os.path.join(self.cache_dir, f"{content_hash}_{self.max_side}_{self.quality}.jpg")
+        if os.path.exists(dst):
+            self.cached += 1
+            try:
+                os.utime(dst)  # недавно отправленные файлы вытесняются последними
+            except OSError:
+                pass
+            return self._smaller(path, st.st_size, dst, os.path.getsize(dst))
+
+        future = self._pending.get(dst)
+        created = future is None
+        if created:
+            if self._pool is None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            future = asyncio.get_running_loop().run_in_executor(
+                self._pool, make_derivative, path, dst, self.max_side, self.quality
+            )
+            self._pending[dst] = future
+        try:
+            size = await asyncio.shield(future)
+        except Exception as e:
+            logger.warning(f"Не удалось подготовить фото {path}, отправляем исходный файл: {e}")
+            return path
+        finally:
+            if future.done():
+                self._pending.pop(dst, None)
+
+        if created:
+            self.converted += 1
+            self.bytes_in += st.st_size
+            self.bytes_out += min(size, st.st_size)
+            await self._account(size)
+        return self._smaller(path, st.st_size, dst, size)
+
+    @staticmethod
+    def _smaller(path: str, size: int, dst: str, dst_size: int) -> str:
+        # Если пересжатие ничего не дало, загружаем исходник
+        return dst if dst_size < size else path
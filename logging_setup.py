@@ -0,0 +1,145 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Контекст текущего апдейта/уведомления: tg_user_id, имя хендлера и время начала.
+# Попадает в каждую запись лога, сделанную внутри этого контекста.
+log_context: ContextVar = ContextVar("log_context", default=None)
+
+
+@contextmanager
+def bind(tg_user_id=None, handler=None):
+    token = log_context.set({"tg_user_id": tg_user_id, "handler": handler, "started": time.perf_counter()})
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    # Работает в потоке, который пишет лог, — поэтому видит контекст корутины
+    def filter(self, record):
+        context = log_context.get()
+        if context:
+            record.tg_user_id = context["tg_user_id"]
+            record.handler = context["handler"]
+            record.duration = round(time.perf_counter() - context["started"], 4)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    # Повторы из одного места кода (логгер, уровень, файл и строка): не больше burst записей
+    # за interval секунд. Подавленные записи не ставятся в очередь; их число дописывается
+    # к первой записи следующего окна.
+    def __init__(self, interval: float = 60, burst: int = 5, max_keys: int = 10000):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_keys = max_keys
+        self._windows: dict = {}  # место в коде -> [начало окна, записей в окне, подавлено]
+
+    def filter(self, record):
+        if self.interval <= 0:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            if window is None and len(self._windows) >= self.max_keys:
+                self._windows.clear()
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.getMessage()} (подавлено похожих записей: {suppressed})"
+                record.args = None
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    # Стандартный prepare() вклеивает traceback в msg и обнуляет exc_info.
+    # Здесь traceback сохраняется отдельно в exc_text: текстовый формат допишет его
+    # после сообщения, как обычно, а JSON положит в поле "exception"
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    # Одна запись — одна строка JSON
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("tg_user_id", "handler", "duration"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+# Логи пишутся из отдельного потока: event loop только кладёт запись в очередь.
+# Файл ротируется по размеру (max_bytes) или по времени (rotate_when, например 'midnight').
+# Как и basicConfig, ничего не делает, если корневой логгер уже настроен.
+def setup_logging(path: str = "app.log", level="WARNING", max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5, rotate_when: str = None, json_lines: bool = False,
+                  console: bool = True, rate_interval: float = 60, rate_burst: int = 5):
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return _listener
+
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=rotate_when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    handlers = [file_handler]
+    if console:
+        handlers.append(logging.StreamHandler())
+    formatter = JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate_interval, rate_burst))
+    queue_handler.addFilter(ContextFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Дописываем очередь при выходе из процесса (если слушатель ещё не остановлен)
+    atexit.register(lambda listener=_listener: listener._thread and listener.stop())
+    return _listener
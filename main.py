@@ -1,47 +1,118 @@
 import asyncio
 import logging
-import re
-import ast
 import os
-import json
+import re
+import tempfile
+import time
+from datetime import date
 
-from aiogram.types import FSInputFile
 from aiogram import Bot, Dispatcher, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, FSInputFile
 
-import asyncpg
 import database
 from config import *
-
-# logging
-logging.basicConfig(
-    level=logging.WARNING,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-    ]
+from sender import SendScheduler, bulk_priority
+from outbox import ClientUpdateOutbox
+from notifications import NotificationCoalescer, decode_changes
+from quota import NotificationQuota
+from metrics import REGISTRY, HandlerMetricsMiddleware, start_metrics_server
+from photo_cache import PhotoCache
+from image_prep import ImagePreprocessor
+from identity_cache import IdentityCache
+from fsm_storage import PostgresStorage, FSMFlushMiddleware
+from throttling import ThrottlingMiddleware
+import client_import
+from broadcast import BroadcastManager, parse_segment, describe_campaign
+from stats import StatsCache, RANGES as STATS_RANGES, render_stats
+from logging_setup import setup_logging, bind as log_bind
+
+# logging: запись в файл идёт из фонового потока, event loop не ждёт диска
+setup_logging(
+    path=log_file,
+    level=log_level,
+    max_bytes=log_max_bytes,
+    backup_count=log_backup_count,
+    rotate_when=log_rotate_when,
+    json_lines=log_json,
+    console=log_console,
+    rate_interval=log_rate_interval,
+    rate_burst=log_rate_burst
 )
 logger = logging.getLogger(__name__)
 
-# FSM storage
-storage = MemoryStorage()
-
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-dp = Dispatcher(storage=storage)
-router = Router()
-dp.include_router(router)
-
 # PostgreSQL main pool для обычных запросов
 database = database.AsyncDatabase(
     db_name=db_name,
     user=user,
     password=password,
     host=host,
-    port=port
+    port=port,
+    min_size=db_pool_min_size,
+    max_size=db_pool_max_size,
+    last_messages_cap=last_messages_cap,
+    statement_cache_size=db_statement_cache_size,
+    max_queries=db_max_queries,
+    max_inactive_lifetime=db_max_inactive_lifetime,
+    replica_host=replica_host,
+    replica_port=replica_port,
+    health_interval=db_health_interval
+)
+
+# FSM storage: состояния диалогов переживают перезапуск бота
+if fsm_storage_backend == 'memory':
+    storage = MemoryStorage()
+else:
+    storage = PostgresStorage(database, cache_size=fsm_cache_size, flush_delay=fsm_flush_delay)
+
+bot = Bot(token=TELEGRAM_BOT_TOKEN)
+# Все исходящие запросы проходят через планировщик с лимитами Telegram
+send_scheduler = SendScheduler(rate=send_rate, chat_interval=send_chat_interval)
+bot.session.middleware(send_scheduler)
+dp = Dispatcher(storage=storage)
+# Лимит апдейтов на пользователя, отброс повторных нажатий и очередь апдейтов одного пользователя.
+# Регистрируется первым, чтобы сброс FSM тоже выполнялся под блокировкой пользователя
+throttling = ThrottlingMiddleware(
+    rate=throttle_rate,
+    burst=throttle_burst,
+    dedup_window=throttle_dedup_window,
+    max_users=throttle_max_users
+)
+dp.update.outer_middleware(throttling)
+if isinstance(storage, PostgresStorage):
+    # Изменения FSM за апдейт сохраняются одной пакетной записью
+    dp.update.outer_middleware(FSMFlushMiddleware(storage))
+router = Router()
+# Задержка и ошибки каждого хендлера
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
+dp.include_router(router)
+
+# Большие фото перед загрузкой уменьшаются в пуле процессов; копии хранятся в image_cache_dir
+image_preprocessor = ImagePreprocessor(
+    cache_dir=image_cache_dir,
+    max_side=image_max_side,
+    quality=image_quality,
+    workers=image_workers,
+    min_bytes=image_min_bytes,
+    max_cache_bytes=image_cache_max_mb * 1024 * 1024
+) if image_prep else None
+if image_preprocessor and not image_preprocessor.enabled:
+    logger.warning("Pillow не установлен, фото отправляются без подготовки")
+
+# Кэш file_id для фото, которые уже загружались в Telegram
+photo_cache = PhotoCache(database, max_size=photo_cache_size, preprocessor=image_preprocessor)
+
+# Роли, админы и известные пользователи в памяти процесса
+identity_cache = IdentityCache(
+    database,
+    database.connect_listener,
+    configured_admins=admin_tg_ids,
+    ttl=identity_cache_ttl
 )
 
 # -------------------------------------------------
@@ -53,16 +124,38 @@ class ChangePhoneStates(StatesGroup):
     waiting_for_old_phone = State()
     waiting_for_new_phone = State()
 
+class AdminSearchStates(StatesGroup):
+    waiting_for_query = State()
+
+class ImportStates(StatesGroup):
+    waiting_for_file = State()
+
+class BroadcastStates(StatesGroup):
+    waiting_for_message = State()
+    waiting_for_segment = State()
+    waiting_for_confirm = State()
+
 # -------------------------------------------------
 # Telegram handlers
 @router.message(Command("start"))
 async def start_command(message: Message, state: FSMContext):
     tg_user_id = message.from_user.id
-    chat_id = message.chat.id
     is_admin = check_admin(tg_user_id)
+    role = 'admin' if is_admin else 'client'
+
+    # Известного пользователя узнаём по кэшу, без запросов к базе
+    await identity_cache.ensure_fresh()
+    created = False
+    if not identity_cache.user_known(tg_user_id):
+        # Проверка существования и регистрация — один запрос к базе
+        try:
+            created = await database.register_user(tg_user_id, role)
+        except Exception as e:
+            logger.error(f"Ошибка при регистрации пользователя {tg_user_id}: {e}")
+            return
+        identity_cache.remember_user(tg_user_id, role)
 
-    user_exist = await database.user_exists(chat_id)
-    if user_exist:
+    if not created:
         if is_admin:
             await main_menu_admin(tg_user_id)
         else:
@@ -72,12 +165,9 @@ async def start_command(message: Message, state: FSMContext):
     await message.answer("👋 Добро пожаловать! Рады вас видеть.")
 
     if is_admin:
-        await database.user_registration(tg_user_id, 'admin')
-        await database.admin_registration(tg_user_id)
         await main_menu_admin(tg_user_id)
         print(tg_user_id)
     else:
-        await database.user_registration(tg_user_id, 'client')
         await message.answer("Введите, пожалуйста, Ваш номер телефона в формате '7xxxxxxxxxx'")
         await state.set_state(PhoneState.waiting_for_phone)
         print(tg_user_id)
@@ -154,6 +244,355 @@ async def change_new_phone(message: Message, state: FSMContext):
 
     await state.clear()
 
+# -------------------------------------------------
+# Поиск клиентов админом: результаты постранично в inline-клавиатуре.
+# Текст запроса хранится в FSM, в callback_data — только курсор страницы (tg_user_id)
+def client_title(row) -> str:
+    name = ' '.join(p for p in (row['first_name'], row['last_name']) if p)
+    return f"{row['tel_num'] or '—'} {name} [статус {row['item_status']}]".strip()
+
+async def render_search_page(query: str, after: int = None, before: int = None):
+    try:
+        rows, has_prev, has_next = await database.search_clients(
+            query, after=after, before=before, limit=search_page_size
+        )
+    except Exception as e:
+        logger.error(f"Ошибка поиска клиентов по запросу {query!r}: {e}")
+        return "Не удалось выполнить поиск, попробуйте позже.", None
+    if not rows:
+        return f"По запросу «{query}» ничего не найдено.", None
+
+    keyboard = [
+        [InlineKeyboardButton(text=client_title(row), callback_data=f"client:{row['tg_user_id']}")]
+        for row in rows
+    ]
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"search:before:{rows[0]['tg_user_id']}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"search:after:{rows[-1]['tg_user_id']}"))
+    if nav:
+        keyboard.append(nav)
+    return f"Клиенты по запросу «{query}»:", InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@router.callback_query(lambda c: c.data == "admin_search")
+async def callback_admin_search(callback: CallbackQuery, state: FSMContext):
+    if not check_admin(callback.from_user.id):
+        await callback.answer()
+        return
+    await state.clear()
+    await callback.message.answer(
+        "Введите часть номера телефона, имя или фамилию клиента либо 'статус N' "
+        "(или 'x' для отмены и возврата в меню):"
+    )
+    await state.set_state(AdminSearchStates.waiting_for_query)
+    await callback.answer()
+
+@router.message(AdminSearchStates.waiting_for_query)
+async def process_search_query(message: Message, state: FSMContext):
+    text = (message.text or '').strip()
+    if text.lower() in ('x', 'х'):
+        await state.clear()
+        await main_menu_admin(message.from_user.id)
+        return
+    if not text:
+        await message.answer("Введите текст для поиска или 'x' для выхода.")
+        return
+
+    # Состояние снимаем, запрос оставляем для перелистывания страниц
+    await state.set_state(None)
+    await state.update_data(search_query=text)
+    page, keyboard = await render_search_page(text)
+    await message.answer(page, reply_markup=keyboard)
+
+@router.callback_query(lambda c: c.data and c.data.startswith("search:"))
+async def callback_search_page(callback: CallbackQuery, state: FSMContext):
+    if not check_admin(callback.from_user.id):
+        await callback.answer()
+        return
+    _, direction, cursor = callback.data.split(':')
+    data = await state.get_data()
+    query = data.get('search_query')
+    if not query:
+        await callback.answer("Поиск устарел, начните заново.")
+        return
+    page, keyboard = await render_search_page(query, **{direction: int(cursor)})
+    try:
+        await callback.message.edit_text(page, reply_markup=keyboard)
+    except Exception:
+        pass  # текст не изменился
+    await callback.answer()
+
+@router.callback_query(lambda c: c.data and c.data.startswith("client:"))
+async def callback_search_client(callback: CallbackQuery):
+    if not check_admin(callback.from_user.id):
+        await callback.answer()
+        return
+    client = await database.get_client(int(callback.data.split(':')[1]))
+    if not client:
+        await callback.answer("Клиент не найден.")
+        return
+    await callback.message.answer(
+        f"Клиент: {client_title(client)}\ntg_id: {client['tg_user_id']}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text='Изменить номер', callback_data=f"client_phone:{client['tg_user_id']}")]
+        ])
+    )
+    await callback.answer()
+
+# Смена номера найденного клиента: сразу к вводу нового номера
+@router.callback_query(lambda c: c.data and c.data.startswith("client_phone:"))
+async def callback_search_change_phone(callback: CallbackQuery, state: FSMContext):
+    if not check_admin(callback.from_user.id):
+        await callback.answer()
+        return
+    await state.clear()
+    await state.update_data(client_tg_id=int(callback.data.split(':')[1]))
+    await callback.message.answer("Введите новый номер телефона в формате '7xxxxxxxxxx' (или 'x' для выхода):")
+    await state.set_state(ChangePhoneStates.waiting_for_new_phone)
+    await callback.answer()
+
+# -------------------------------------------------
+# Импорт клиентской базы из CSV/XLSX: файл читается построчно и загружается пачками через COPY
+@router.message(Command("import"))
+async def import_command(message: Message, state: FSMContext):
+    if not check_admin(message.from_user.id):
+        return
+    await state.clear()
+    await message.answer(
+        "Отправьте файл CSV или XLSX со столбцами: телефон, имя, фамилия, статус "
+        "(первая строка может быть заголовком). Для отмены введите 'x'."
+    )
+    await state.set_state(ImportStates.waiting_for_file)
+
+@router.message(ImportStates.waiting_for_file)
+async def process_import_file(message: Message, state: FSMContext):
+    if message.text and message.text.strip().lower() in ('x', 'х'):
+        await state.clear()
+        await main_menu_admin(message.from_user.id)
+        return
+    document = message.document
+    if document is None or not (document.file_name or '').lower().endswith(('.csv', '.xlsx')):
+        await message.answer("Нужен файл .csv или .xlsx. Отправьте файл или введите 'x' для отмены.")
+        return
+    await state.clear()
+
+    progress = await message.answer("Загружаю файл...")
+    last_edit = time.monotonic()
+
+    async def on_progress(loaded: int):
+        nonlocal last_edit
+        # Не чаще раза в пару секунд, чтобы не упираться в лимиты Telegram
+        if time.monotonic() - last_edit >= 2:
+            last_edit = time.monotonic()
+            try:
+                await progress.edit_text(f"Обработано строк: {loaded}...")
+            except Exception:
+                pass
+
+    report = client_import.ImportReport()
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(document.file_name)[1])
+    os.close(fd)
+    try:
+        await bot.download(document, destination=path)
+        chunks = client_import.parse_records(
+            client_import.read_rows(path, document.file_name), report, chunk_size=import_chunk_size
+        )
+        report.updated, report.pending = await database.import_clients(
+            chunks, client_import.COLUMNS, on_progress=on_progress
+        )
+    except Exception as e:
+        logger.error(f"Ошибка импорта файла {document.file_name}: {e}")
+        await progress.edit_text(f"Импорт не выполнен: {e}")
+        return
+    finally:
+        os.remove(path)
+    await progress.edit_text(report.summary())
+
+# -------------------------------------------------
+# Рассылки: текст (и фото) -> сегмент -> подтверждение; отправляет BroadcastManager
+async def ask_broadcast_message(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Отправьте текст рассылки или фото с подписью (или 'x' для отмены):")
+    await state.set_state(BroadcastStates.waiting_for_message)
+
+@router.message(Command("broadcast"))
+async def broadcast_command(message: Message, state: FSMContext):
+    if check_admin(message.from_user.id):
+        await ask_broadcast_message(message, state)
+
+@router.callback_query(lambda c: c.data == "admin_broadcast")
+async def callback_admin_broadcast(callback: CallbackQuery, state: FSMContext):
+    if check_admin(callback.from_user.id):
+        await ask_broadcast_message(callback.message, state)
+    await callback.answer()
+
+@router.message(BroadcastStates.waiting_for_message)
+async def process_broadcast_message(message: Message, state: FSMContext):
+    if message.text and message.text.strip().lower() in ('x', 'х'):
+        await state.clear()
+        await main_menu_admin(message.from_user.id)
+        return
+    photo = message.photo[-1].file_id if message.photo else None
+    text = (message.caption if photo else message.text) or ''
+    if not text and not photo:
+        await message.answer("Нужен текст или фото. Попробуйте ещё раз или введите 'x' для выхода.")
+        return
+    if photo and len(text) > 1024:
+        await message.answer("Подпись к фото длиннее 1024 символов. Сократите текст.")
+        return
+
+    await state.update_data(bc_text=text, bc_photo=photo)
+    await message.answer(
+        "Кому отправить? Напишите 'все', 'статус N', 'дата ДД.ММ.ГГГГ-ДД.ММ.ГГГГ' "
+        "(дата регистрации) или сочетание, например 'статус 2 дата 01.01.2024-31.03.2024'."
+    )
+    await state.set_state(BroadcastStates.waiting_for_segment)
+
+@router.message(BroadcastStates.waiting_for_segment)
+async def process_broadcast_segment(message: Message, state: FSMContext):
+    text = (message.text or '').strip()
+    if text.lower() in ('x', 'х'):
+        await state.clear()
+        await main_menu_admin(message.from_user.id)
+        return
+    try:
+        segment = parse_segment(text)
+    except ValueError:
+        await message.answer("Не понял сегмент. Пример: 'все', 'статус 2' или 'дата 01.01.2024-31.03.2024'.")
+        return
+
+    total = await database.count_recipients(**segment)
+    await state.update_data(bc_segment={k: v.isoformat() if isinstance(v, date) else v for k, v in segment.items()})
+    await message.answer(
+        f"Получателей: {total}. Запустить рассылку?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Запустить", callback_data="bc_confirm")],
+            [InlineKeyboardButton(text="Отмена", callback_data="bc_discard")]
+        ])
+    )
+    await state.set_state(BroadcastStates.waiting_for_confirm)
+
+@router.callback_query(BroadcastStates.waiting_for_confirm, lambda c: c.data == "bc_confirm")
+async def callback_broadcast_confirm(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    segment = {
+        k: date.fromisoformat(v) if k != 'item_status' and v else v
+        for k, v in data['bc_segment'].items()
+    }
+    campaign = await database.create_campaign(
+        callback.from_user.id, data['bc_text'], data['bc_photo'], **segment
+    )
+    await broadcaster.launch(campaign['id'])
+    await callback.message.edit_text(f"Рассылка #{campaign['id']} запущена: {campaign['total']} получателей.\n"
+                                     f"Ход рассылки — /broadcasts")
+    await callback.answer()
+
+@router.callback_query(lambda c: c.data == "bc_discard")
+async def callback_broadcast_discard(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Рассылка отменена.")
+    await callback.answer()
+
+# Список последних рассылок с кнопками паузы, продолжения и отмены
+async def render_campaigns():
+    campaigns = await database.list_campaigns()
+    if not campaigns:
+        return "Рассылок пока не было.", None
+    keyboard = []
+    for campaign in campaigns:
+        row = []
+        if campaign['state'] == 'running':
+            row.append(InlineKeyboardButton(text=f"⏸ #{campaign['id']}", callback_data=f"bc:pause:{campaign['id']}"))
+        if campaign['state'] == 'paused':
+            row.append(InlineKeyboardButton(text=f"▶️ #{campaign['id']}", callback_data=f"bc:resume:{campaign['id']}"))
+        if campaign['state'] in ('running', 'paused'):
+            row.append(InlineKeyboardButton(text=f"✖ #{campaign['id']}", callback_data=f"bc:cancel:{campaign['id']}"))
+        if row:
+            keyboard.append(row)
+    keyboard.append([InlineKeyboardButton(text="Обновить", callback_data="bc:refresh:0")])
+    text = '\n'.join(describe_campaign(c) for c in campaigns)
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@router.message(Command("broadcasts"))
+async def broadcasts_command(message: Message):
+    if not check_admin(message.from_user.id):
+        return
+    text, keyboard = await render_campaigns()
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(lambda c: c.data == "admin_broadcasts")
+async def callback_admin_broadcasts(callback: CallbackQuery):
+    if check_admin(callback.from_user.id):
+        text, keyboard = await render_campaigns()
+        await callback.message.answer(text, reply_markup=keyboard)
+    await callback.answer()
+
+# Переходы состояния: действие -> (новое состояние, из каких состояний можно)
+CAMPAIGN_ACTIONS = {
+    'pause': ('paused', ['running']),
+    'resume': ('running', ['paused']),
+    'cancel': ('cancelled', ['running', 'paused']),
+}
+
+@router.callback_query(lambda c: c.data and c.data.startswith("bc:"))
+async def callback_campaign_action(callback: CallbackQuery):
+    if not check_admin(callback.from_user.id):
+        await callback.answer()
+        return
+    _, action, campaign_id = callback.data.split(':')
+    if action in CAMPAIGN_ACTIONS:
+        new_state, allowed_from = CAMPAIGN_ACTIONS[action]
+        campaign = await database.set_campaign_state(int(campaign_id), new_state, allowed_from)
+        if campaign and action == 'resume':
+            await broadcaster.launch(campaign['id'])
+    text, keyboard = await render_campaigns()
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except Exception:
+        pass  # текст не изменился
+    await callback.answer()
+
+# -------------------------------------------------
+# Статистика: счётчики ведут триггеры в базе, снимок держится в памяти stats_cache_ttl секунд
+stats_cache = StatsCache(database, ttl=stats_cache_ttl, max_days=stats_max_days)
+
+async def render_stats_page(days: int = 7):
+    snapshot = await stats_cache.snapshot()
+    keyboard = [[
+        InlineKeyboardButton(text=f"{'• ' if d == days else ''}{d} дн.", callback_data=f"stats:{d}")
+        for d in STATS_RANGES if d <= stats_max_days
+    ]]
+    return render_stats(snapshot, days), InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@router.message(Command("stats"))
+async def stats_command(message: Message):
+    if not check_admin(message.from_user.id):
+        return
+    text, keyboard = await render_stats_page()
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(lambda c: c.data == "admin_stats")
+async def callback_admin_stats(callback: CallbackQuery):
+    if check_admin(callback.from_user.id):
+        text, keyboard = await render_stats_page()
+        await callback.message.answer(text, reply_markup=keyboard)
+    await callback.answer()
+
+@router.callback_query(lambda c: c.data and c.data.startswith("stats:"))
+async def callback_stats_range(callback: CallbackQuery):
+    if not check_admin(callback.from_user.id):
+        await callback.answer()
+        return
+    days = min(int(callback.data.split(':')[1]), stats_max_days)
+    text, keyboard = await render_stats_page(days)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except Exception:
+        pass  # текст не изменился
+    await callback.answer()
+
 
 @router.message(PhoneState.waiting_for_phone)
 async def process_phone_number(message: Message, state: FSMContext):
@@ -187,14 +626,16 @@ async def callback_confirm_phone(callback: CallbackQuery, state: FSMContext):
     await database.client_registration(tg_user_id, phone_number)
     await callback.message.answer(f"Ваш номер телефона {phone_number} сохранён в базе данных.")
     # **Уведомляем админов**
-    admin_ids = await database.get_all_admin_ids()
+    await identity_cache.ensure_fresh()
+    admin_ids = identity_cache.get_admin_ids()
     notification = f"Новый клиент зарегистрирован с номером: {phone_number} (tg_id: {tg_user_id})"
-    for admin_id in admin_ids:
-        # не забудьте обработать возможные ошибки отправки
-        try:
-            await bot.send_message(chat_id=admin_id, text=notification)
-        except Exception as e:
-            logger.error(f"Не удалось уведомить администратора {admin_id}: {e}")
+    with bulk_priority():
+        for admin_id in admin_ids:
+            # не забудьте обработать возможные ошибки отправки
+            try:
+                await bot.send_message(chat_id=admin_id, text=notification)
+            except Exception as e:
+                logger.error(f"Не удалось уведомить администратора {admin_id}: {e}")
 
     # Завершаем FSM и показываем клиенту меню
     await state.clear()
@@ -216,27 +657,23 @@ async def MMenu(callback: CallbackQuery):
     await main_menu_client(callback.from_user.id)
 
 # -------------------------------------------------
-# Admin check (unchanged)
+# Admin check: список admin_tg_ids разбирается один раз при старте
 def check_admin(tg_user_id: int) -> bool:
-    raw_ids = os.getenv("admin_tg_ids", "[]").strip()
-    try:
-        ids = ast.literal_eval(raw_ids)
-        ids = [int(x) for x in ids]
-    except Exception:
-        ids = []
-    return tg_user_id in ids
+    return identity_cache.is_configured_admin(tg_user_id)
 
 # -------------------------------------------------
-# Safe delete last messages (unchanged)
+# Safe delete last messages: id забираются из базы с очисткой одним запросом
+# и удаляются пачками через deleteMessages (до 100 id за вызов)
+DELETE_MESSAGES_CHUNK = 100
+
 async def safely_delete_last_message(tg_user_id: int, chat_id: int):
     try:
-        last_messages = await database.get_last_messages_by_user_id(tg_user_id)
-        for msg_id in last_messages or []:
+        last_messages = await database.take_last_messages_by_user_id(tg_user_id)
+        for i in range(0, len(last_messages), DELETE_MESSAGES_CHUNK):
             try:
-                await bot.delete_message(chat_id=chat_id, message_id=msg_id)
+                await bot.delete_messages(chat_id=chat_id, message_ids=last_messages[i:i + DELETE_MESSAGES_CHUNK])
             except Exception:
                 continue
-        await database.clear_last_message_ids_by_user_id(tg_user_id)
     except Exception as e:
         logger.error("Ошибка в safely_delete_last_message: %s", e)
 
@@ -253,7 +690,11 @@ async def main_menu_client(tg_user_id: int):
 async def main_menu_admin(tg_user_id: int):
     try:
         inline_kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text='Изменить номер', callback_data='admin_change_phone')]
+            [InlineKeyboardButton(text='Изменить номер', callback_data='admin_change_phone')],
+            [InlineKeyboardButton(text='Найти клиента', callback_data='admin_search')],
+            [InlineKeyboardButton(text='Новая рассылка', callback_data='admin_broadcast'),
+             InlineKeyboardButton(text='Рассылки', callback_data='admin_broadcasts')],
+            [InlineKeyboardButton(text='Статистика', callback_data='admin_stats')]
         ])
         await bot.send_message(tg_user_id, "Добро пожаловать в админ-панель!")
         await bot.send_message(tg_user_id, "Выберите действие:", reply_markup=inline_kb)
@@ -261,64 +702,207 @@ async def main_menu_admin(tg_user_id: int):
         logger.error("Ошибка в main_menu: %s", e)
 
 # -------------------------------------------------
-# PostgreSQL LISTEN/NOTIFY listener for client_update channel
-async def start_listener():
-    conn = await asyncpg.connect(
-        database=db_name,
-        user=user,
-        password=password,
-        host=host,
-        port=port,
-    )
-
-    async def on_notify(_conn, pid, channel, payload):
-        logger.info(f"[notify] channel={channel}, payload={payload!r}")
+# Обработка изменений client_update (выполняется воркером пайплайна)
+# Порядок столбцов задаёт порядок в сообщении: текст, изделие, квитанция
+PHOTO_COLUMNS = ('product_photo_path', 'receipt_photo_path')
+NOTIFY_COLUMNS = [c for c in ('notif_text',) + PHOTO_COLUMNS if c in notify_columns]
+CAPTION_LIMIT = 1024
+
+# Файл документом, без сжатия Telegram: локальный путь загружается, иначе это URL или file_id
+async def send_document(tg: int, path: str, caption: str = None):
+    document = FSInputFile(path) if os.path.exists(path) else path
+    await bot.send_document(chat_id=tg, document=document, caption=caption)
+
+async def send_photo_or_document(tg: int, path: str, caption: str = None):
+    try:
+        await photo_cache.send_photo(bot, tg, path, caption=caption)
+    except TelegramBadRequest as e:
+        # Telegram не принял файл как фото (размеры, формат) — отправляем документом
+        logger.warning(f"Фото {path} не принято, отправляем документом: {e}")
+        await send_document(tg, path, caption=caption)
+
+# Отправляет клиенту накопленные изменения минимальным числом запросов:
+# несколько фото — одним альбомом с текстом в подписи, одно фото — с подписью, иначе текст.
+# При receipt_as_document квитанция уходит отдельным документом в исходном разрешении.
+# Пустые значения (поле очистили) клиенту не отправляются.
+async def send_client_changes(tg: int, changes: dict):
+    text = changes.get('notif_text') or None
+    receipt = changes.get('receipt_photo_path') if receipt_as_document else None
+    photos = [changes[c] for c in PHOTO_COLUMNS if changes.get(c) and changes[c] != receipt]
+    if text and (photos or receipt) and len(text) > CAPTION_LIMIT:
+        # Слишком длинный текст для подписи — отдельным сообщением
+        await bot.send_message(chat_id=tg, text=text)
+        text = None
+    if len(photos) > 1:
         try:
-            data = json.loads(payload)
-            old = data.get('old', {})
-            new = data.get('new', {})
-            tg = int(new.get('tg_user_id') or old.get('tg_user_id'))
-
-            # 1) Текст уведомления
-            new_text = new.get('notif_text')
-            if new_text and new_text != old.get('notif_text'):
-                await bot.send_message(chat_id=tg, text=new_text)
-
-            # 2) Фото изделия
-            new_prod = new.get('product_photo_path')
-            if new_prod and new_prod != old.get('product_photo_path'):
-                if os.path.exists(new_prod):
-                    photo = FSInputFile(new_prod)
-                else:
-                    photo = new_prod
-                await bot.send_photo(chat_id=tg, photo=photo)
-
-            # 3) Фото квитанции
-            new_rec = new.get('receipt_photo_path')
-            if new_rec and new_rec != old.get('receipt_photo_path'):
-                if os.path.exists(new_rec):
-                    photo = FSInputFile(new_rec)
-                else:
-                    photo = new_rec
-                await bot.send_photo(chat_id=tg, photo=photo)
+            await photo_cache.send_media_group(bot, tg, photos, caption=text)
+        except TelegramBadRequest as e:
+            # Альбом не принят целиком — отправляем по одному, подпись у первого
+            logger.warning(f"Альбом для {tg} не принят, отправляем по одному: {e}")
+            for i, path in enumerate(photos):
+                await send_photo_or_document(tg, path, caption=text if i == 0 else None)
+        text = None
+    elif photos:
+        await send_photo_or_document(tg, photos[0], caption=text)
+        text = None
+    if receipt:
+        await send_document(tg, receipt, caption=text)
+    elif text:
+        await bot.send_message(chat_id=tg, text=text)
+
+# Дневной лимит уведомлений на клиента (notif_count / last_notif_date в client_info)
+notification_quota = NotificationQuota(
+    database,
+    daily_limit=notify_daily_limit,
+    flush_interval=notify_quota_flush_interval
+)
 
-        except Exception as e:
-            logger.error("Notify handler error: %s", e)
+async def send_coalesced(tg: int, changes: dict):
+    if not any(changes.values()):
+        return
+    with log_bind(tg_user_id=tg, handler='client_update'):
+        if not await notification_quota.allow(tg):
+            logger.warning(f"Клиент {tg} исчерпал дневной лимит уведомлений, изменения не отправлены")
+            return
+        with bulk_priority():
+            await send_client_changes(tg, changes)
+
+# Изменения одного клиента за notify_coalesce_window секунд сливаются в одну отправку
+notification_coalescer = NotificationCoalescer(
+    send_coalesced,
+    window=notify_coalesce_window,
+    max_delay=notify_coalesce_max_delay
+)
 
-    await conn.add_listener('client_update', on_notify)
-    logger.info("Listening on client_update...")
-    try:
-        while True:
-            await asyncio.sleep(3600)
-    finally:
-        await conn.close()
+async def handle_client_update(tg: int, payload: dict):
+    changes = decode_changes(payload, NOTIFY_COLUMNS)
+    if notify_coalesce_window > 0:
+        # Возвращаем future: строка outbox подтвердится после фактической отправки
+        return notification_coalescer.add(tg, changes)
+    await send_coalesced(tg, changes)
+
+# Изменения client_info приходят через client_update_outbox (см. SQL_code_refresh.txt)
+notification_outbox = ClientUpdateOutbox(
+    database,
+    database.connect_listener,
+    handle_client_update,
+    workers=notify_workers,
+    queue_size=notify_queue_size,
+    batch_size=outbox_batch_size,
+    lease=outbox_lease,
+    standby_interval=outbox_standby_interval,
+    max_deferred=outbox_max_deferred,
+    # Пока лидером был другой процесс, счётчики лимита в памяти устарели
+    on_leader=notification_quota.forget
+)
+
+# Рассылки клиентам: отправка одному получателю и отчёт автору по завершении
+async def send_broadcast(campaign, tg_user_id: int):
+    if campaign['photo_file_id']:
+        await bot.send_photo(tg_user_id, photo=campaign['photo_file_id'], caption=campaign['text'] or None)
+    else:
+        await bot.send_message(tg_user_id, campaign['text'])
+
+async def broadcast_finished(campaign):
+    await bot.send_message(campaign['created_by'], describe_campaign(campaign))
+
+broadcaster = BroadcastManager(
+    database,
+    send_broadcast,
+    on_finish=broadcast_finished,
+    batch_size=broadcast_batch_size,
+    lease=broadcast_lease
+)
+
+
+# -------------------------------------------------
+# Метрики: значения читаются из счётчиков компонентов в момент запроса /metrics
+def register_metrics():
+    REGISTRY.gauge('bot_db_pool_connections', 'Соединения пула asyncpg', lambda: {
+        (k,): v for k, v in database.pool_stats().items()
+    }, labels=('state',))
+    REGISTRY.gauge('bot_send_queue_depth', 'Запросы в очереди планировщика отправки',
+                   lambda: send_scheduler.stats()['queue_depth'])
+    REGISTRY.counter_fn('bot_sends_total', 'Исходящие запросы к Bot API', lambda: {
+        ('sent',): send_scheduler.sent, ('retried',): send_scheduler.retries, ('failed',): send_scheduler.failed,
+    }, labels=('result',))
+    REGISTRY.gauge('bot_send_wait_seconds', 'Ожидание в очереди отправки', lambda: {
+        ('avg',): send_scheduler.stats()['wait_avg'], ('max',): send_scheduler.wait_max,
+    }, labels=('stat',))
+    REGISTRY.gauge('bot_notify_listening', 'Слушатель client_update подключён',
+                   lambda: int(notification_outbox.listening))
+    REGISTRY.gauge('bot_notify_leader', 'Процесс — лидер, разбирающий client_update_outbox',
+                   lambda: int(notification_outbox.leader))
+    REGISTRY.counter_fn('bot_notify_elections_total', 'Сколько раз процесс становился лидером',
+                        lambda: notification_outbox.elections)
+    REGISTRY.counter_fn('bot_notify_events_total', 'События слушателя client_update', lambda: {
+        ('wakeup',): notification_outbox.wakeups, ('reconnect',): notification_outbox.reconnects,
+        ('claimed',): notification_outbox.claimed, ('acked',): notification_outbox.acked,
+        ('retried',): notification_outbox.retried,
+    }, labels=('event',))
+    REGISTRY.counter_fn('bot_updates_total', 'Апдейты после защиты от флуда', lambda: {
+        ('passed',): throttling.passed, ('throttled',): throttling.throttled, ('duplicate',): throttling.duplicates,
+    }, labels=('result',))
+    REGISTRY.gauge('bot_broadcasts_active', 'Рассылки, которые отправляет этот процесс', broadcaster.active)
+    REGISTRY.counter_fn('bot_broadcast_messages_total', 'Сообщения рассылок', lambda: {
+        ('sent',): broadcaster.sent, ('failed',): broadcaster.failed,
+    }, labels=('result',))
+    REGISTRY.gauge('bot_notify_coalesce_pending', 'Клиенты с неотправленным буфером изменений',
+                   notification_coalescer.pending)
+    REGISTRY.counter_fn('bot_notify_coalesce_total', 'Слияние изменений client_info', lambda: {
+        ('added',): notification_coalescer.added, ('flushed',): notification_coalescer.flushed,
+        ('superseded',): notification_coalescer.superseded,
+    }, labels=('event',))
+    REGISTRY.counter_fn('bot_notify_quota_total', 'Проверки дневного лимита уведомлений', lambda: {
+        ('allowed',): notification_quota.allowed, ('blocked',): notification_quota.blocked,
+    }, labels=('result',))
+    REGISTRY.gauge('bot_notify_quota_dirty', 'Счётчики уведомлений, ещё не записанные в базу',
+                   notification_quota.dirty)
+    if image_preprocessor:
+        REGISTRY.counter_fn('bot_image_prep_total', 'Подготовка фото перед загрузкой', lambda: {
+            ('converted',): image_preprocessor.converted, ('cached',): image_preprocessor.cached,
+            ('evicted',): image_preprocessor.evicted,
+        }, labels=('result',))
+        REGISTRY.counter_fn('bot_image_prep_bytes_total', 'Размер подготовленных фото', lambda: {
+            ('in',): image_preprocessor.bytes_in, ('out',): image_preprocessor.bytes_out,
+        }, labels=('direction',))
+    REGISTRY.counter_fn('bot_stats_snapshot_total', 'Снимки статистики для админа', lambda: {
+        ('cached',): stats_cache.hits, ('loaded',): stats_cache.loads,
+    }, labels=('result',))
+    REGISTRY.gauge('bot_notify_queue_depth', 'Уведомления в очереди пайплайна',
+                   lambda: notification_outbox.pipeline.depth())
+    REGISTRY.counter_fn('bot_notify_processed_total', 'Обработанные уведомления', lambda: {
+        ('ok',): notification_outbox.pipeline.processed - notification_outbox.pipeline.failed,
+        ('failed',): notification_outbox.pipeline.failed,
+    }, labels=('result',))
+
+register_metrics()
 
 
 # -------------------------------------------------
 # Startup and polling
+# В webhook-режиме с несколькими процессами outbox client_update слушает только один из них.
+# Между копиями бота лидер выбирается advisory-блокировкой (см. outbox.py)
+listen_notifications = True
+metrics_runner = None
+
 async def on_startup():
+    global metrics_runner
     await database.connect()
-    asyncio.create_task(start_listener())
+    if metrics_port and metrics_runner is None:
+        try:
+            metrics_runner = await start_metrics_server(metrics_host, metrics_port)
+        except OSError as e:
+            logger.error(f"Не удалось открыть порт метрик {metrics_port}: {e}")
+    send_scheduler.start()
+    identity_cache.start()
+    # Рассылки, прерванные падением процесса, продолжаются с последней подтверждённой пачки
+    broadcaster.start()
+    if listen_notifications:
+        # Триггер должен присылать ровно те столбцы, которые обрабатывает бот
+        await database.sync_client_update_trigger(NOTIFY_COLUMNS)
+        notification_quota.start()
+        notification_outbox.start()
 
 async def safe_polling(dp: Dispatcher):
     delay = 1
@@ -331,8 +915,19 @@ async def safe_polling(dp: Dispatcher):
             await asyncio.sleep(delay)
             delay = min(delay * 2, 60)
 
+async def on_shutdown():
+    await broadcaster.close()
+    await identity_cache.close()
+    await notification_outbox.close()
+    await notification_coalescer.close()
+    await notification_quota.close()
+    await send_scheduler.close()
+    if image_preprocessor:
+        image_preprocessor.close()
+
 async def main():
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     await safe_polling(dp)
 
 if __name__ == '__main__':
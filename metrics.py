@@ -0,0 +1,161 @@
+import bisect
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+from logging_setup import bind as log_bind
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict = {}
+
+    def inc(self, *label_values, value: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for values, value in self._values.items():
+            yield f'{self.name}{_labels(self.labels, values)} {value}'
+
+
+class Histogram:
+    # Гистограмма без блокировок: на одно наблюдение — bisect и пара сложений
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: dict = {}  # label_values -> [counts по бакетам..., +Inf, sum]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        names = self.labels + ('le',)
+        for values, series in self._series.items():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                total += count
+                yield f'{self.name}_bucket{_labels(names, values + (bound,))} {total}'
+            yield f'{self.name}_sum{_labels(self.labels, values)} {series[-1]}'
+            yield f'{self.name}_count{_labels(self.labels, values)} {total}'
+
+
+class CallbackMetric:
+    # Значение читается только в момент запроса /metrics — на горячем пути ничего не стоит.
+    # fn возвращает число или словарь {кортеж значений меток: число}.
+    def __init__(self, name: str, help: str, fn, kind: str = 'gauge', labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labels = tuple(labels)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning(f"Метрика {self.name} недоступна: {e}")
+            return
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        if isinstance(value, dict):
+            for values, v in value.items():
+                yield f'{self.name}{_labels(self.labels, values)} {v}'
+        else:
+            yield f'{self.name} {value}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, fn, labels=()):
+        return self.register(CallbackMetric(name, help, fn, 'gauge', labels))
+
+    def counter_fn(self, name: str, help: str, fn, labels=()):
+        return self.register(CallbackMetric(name, help, fn, 'counter', labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'bot_handler_seconds', 'Время работы хендлера', labels=('handler',)
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'bot_handler_errors_total', 'Исключения в хендлерах', labels=('handler',)
+))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'bot_db_query_seconds', 'Время запроса к PostgreSQL (включая ожидание соединения)', labels=('query',)
+))
+DB_QUERY_ERRORS = REGISTRY.register(Counter(
+    'bot_db_query_errors_total', 'Ошибки запросов к PostgreSQL', labels=('query',)
+))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Внутренний middleware роутера: к этому моменту хендлер уже выбран фильтрами,
+    # поэтому задержку можно подписать его именем.
+    # Имя хендлера и пользователь попадают и в контекст логов.
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        user = data.get('event_from_user')
+        started = time.perf_counter()
+        try:
+            with log_bind(tg_user_id=user.id if user else None, handler=name):
+                return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+# Локальный HTTP-эндпоинт в текстовом формате Prometheus
+async def start_metrics_server(host: str, port: int, registry: Registry = REGISTRY):
+    async def handle(_request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationPipeline:
+    # Ограниченная очередь уведомлений с пулом воркеров.
+    # Каждый tg_user_id всегда попадает к одному и тому же воркеру,
+    # поэтому уведомления одного клиента обрабатываются строго по порядку,
+    # а разные клиенты обрабатываются параллельно.
+    def __init__(self, handler, workers: int = 4, queue_size: int = 1000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        per_worker = max(1, queue_size // self.workers)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks: list = []
+
+        # Счётчики
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.blocked = 0  # сколько раз продюсер ждал свободного места
+        self.max_depth = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    # ----------helping_methods-------------
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def close(self, drain: bool = True):
+        if drain:
+            for q in self._queues:
+                await q.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "latency_avg": self.latency_total / self.processed if self.processed else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+    # Кладёт уведомление в очередь воркера клиента.
+    # Если очередь заполнена — ждёт (backpressure), а не создаёт новые корутины.
+    async def submit(self, tg_user_id: int, item):
+        queue = self._queues[tg_user_id % self.workers]
+        entry = (time.monotonic(), item)
+        self.submitted += 1
+        if queue.full():
+            self.blocked += 1
+            await queue.put(entry)
+        else:
+            queue.put_nowait(entry)
+        self.max_depth = max(self.max_depth, self.depth())
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            enqueued, item = await queue.get()
+            try:
+                await self.handler(item)
+            except Exception as e:
+                self.failed += 1
+                logger.error("Notification worker error: %s", e)
+            finally:
+                elapsed = time.monotonic() - enqueued
+                self.processed += 1
+                self.latency_total += elapsed
+                self.latency_max = max(self.latency_max, elapsed)
+                queue.task_done()
+
+
+class NotificationCoalescer:
+    # Буфер изменений на пользователя (debounce).
+    # Изменения одного пользователя, пришедшие с паузами меньше window секунд, сливаются
+    # в одно: по каждому столбцу остаётся последнее значение, промежуточные тексты выбрасываются.
+    # Буфер отправляется через window секунд тишины, но не позже max_delay после первого изменения.
+    # add() возвращает future, который завершается после отправки (с ошибкой отправки,
+    # если она была) — по нему outbox подтверждает строки, так что при падении процесса
+    # или временной ошибке изменения не теряются.
+    # Отправки одного пользователя идут строго по очереди.
+    def __init__(self, flush, window: float = 2.0, max_delay: float = 10.0):
+        self.flush = flush  # корутина flush(key, changes)
+        self.window = window
+        self.max_delay = max_delay
+        self._buffers: dict = {}  # key -> [changes, futures, время первого изменения, таймер]
+        self._inflight: dict = {}  # key -> задача отправки, которую ждёт следующая
+
+        # Счётчики
+        self.added = 0
+        self.flushed = 0
+        self.superseded = 0  # значения, перезаписанные более новыми до отправки
+
+    # ----------helping_methods-------------
+    def pending(self) -> int:
+        return len(self._buffers)
+
+    def add(self, key, changes: dict) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        now = loop.time()
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = [{}, [], now, None]
+        else:
+            buffer[3].cancel()
+        self.added += 1
+        self.superseded += sum(1 for c in changes if c in buffer[0])
+        buffer[0].update(changes)
+        buffer[1].append(future)
+        delay = min(self.window, buffer[2] + self.max_delay - now)
+        buffer[3] = loop.call_later(max(0.0, delay), self._fire, key)
+        return future
+
+    def _fire(self, key):
+        buffer = self._buffers.pop(key, None)
+        if buffer is None:
+            return
+        buffer[3].cancel()
+        previous = self._inflight.get(key)
+        task = asyncio.create_task(self._flush(key, buffer[0], buffer[1], previous))
+        self._inflight[key] = task
+
+        def done(finished):
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+
+        task.add_done_callback(done)
+
+    async def _flush(self, key, changes: dict, futures: list, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        error = None
+        try:
+            await self.flush(key, changes)
+        except asyncio.CancelledError:
+            # Отправка прервана остановкой — изменения не подтверждаются
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error("Notification flush error for %s: %s", key, e)
+            error = e
+        self.flushed += 1
+        # Ошибку получают все слитые изменения: по ней outbox решает, повторять ли отправку
+        for future in futures:
+            if not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    # Отправляет всё накопленное сразу и ждёт завершения отправок
+    async def close(self):
+        for key in list(self._buffers):
+            self._fire(key)
+        if self._inflight:
+            await asyncio.wait(list(self._inflight.values()))
+
+
+# Изменённые столбцы client_info из строки outbox.
+# Триггер присылает только изменённые наблюдаемые столбцы: {"notif_text": "..."}.
+# Строки старого формата {"old": {...}, "new": {...}} (записанные до обновления триггера)
+# приводятся к тому же виду.
+def decode_changes(payload: dict, columns) -> dict:
+    new = payload.get('new')
+    if isinstance(new, dict) and isinstance(payload.get('old'), dict):
+        old = payload['old']
+        return {c: new.get(c) for c in columns if new.get(c) != old.get(c)}
+    return {c: payload[c] for c in columns if c in payload}
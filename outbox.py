@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from notifications import NotificationPipeline
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'client_update'
+# Ключ сессионной advisory-блокировки лидера: outbox разбирает только её владелец
+LEADER_LOCK_KEY = 7_310_512_015
+
+# Ошибки, которые повтор не исправит (бот заблокирован, чат удалён, неверный запрос):
+# такую строку закрываем. Остальные (сеть, 5xx Telegram, база) — строка остаётся
+# неподтверждённой и будет отправлена снова, когда истечёт аренда.
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)
+
+
+class ClientUpdateOutbox:
+    # Доставка изменений client_info через таблицу client_update_outbox.
+    # Триггер пишет строку в outbox в той же транзакции, что и UPDATE, а NOTIFY лишь будит бота.
+    # Бот пачками забирает недоставленные строки (FOR UPDATE SKIP LOCKED с арендой lease секунд),
+    # отдаёт их в пайплайн уведомлений и пачкой же отмечает доставленными.
+    # Если бот упал посреди отправки или отправка не удалась из-за временной ошибки,
+    # аренда истекает и строки будут отправлены снова (at-least-once). При старте и после переподключения слушателя outbox вычитывается целиком.
+    # Из нескольких копий бота отправляет только лидер — владелец advisory-блокировки
+    # на соединении слушателя. Остальные держат соединение и каждые standby_interval секунд
+    # пробуют взять блокировку; она освобождается сама, как только соединение лидера рвётся.
+    # Отложенных (ещё не подтверждённых) отправок не больше max_deferred: дальше воркер
+    # пайплайна ждёт, очередь заполняется, и drain перестаёт забирать строки — иначе
+    # хвост отправки мог бы пережить аренду, и строки ушли бы клиентам повторно.
+    def __init__(self, database, connect, handler, workers: int = 4, queue_size: int = 1000,
+                 batch_size: int = 100, lease: int = 300, poll_interval: float = 30, keep_days: int = 7,
+                 standby_interval: float = 5, max_deferred: int = None, on_leader=None):
+        self.database = database
+        self.connect = connect  # корутина-фабрика соединения для LISTEN
+        # Обработка одного изменения: handler(tg_user_id, payload). Если handler вернул future
+        # (отложенная отправка), строка подтверждается, когда future завершится
+        self.handler = handler
+        self.on_leader = on_leader  # вызывается, когда процесс становится лидером (сброс локальных кэшей)
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.keep_days = keep_days  # сколько дней хранить доставленные строки
+        self.standby_interval = standby_interval
+        self.pipeline = NotificationPipeline(self._process, workers=workers, queue_size=queue_size)
+
+        self._wakeup = asyncio.Event()
+        self._acks: list = []
+        self._deferred: set = set()
+        self._deferred_slots = asyncio.Semaphore(max_deferred or queue_size)
+        self._tasks: list = []
+        self._listening = False
+        self._leader = False
+
+        # Счётчики
+        self.elections = 0  # сколько раз этот процесс становился лидером
+        self.claimed = 0
+        self.acked = 0
+        self.retried = 0  # строк, оставленных до повторной отправки после временной ошибки
+        self.wakeups = 0
+        self.reconnects = 0
+
+    # ----------helping_methods-------------
+    def start(self):
+        if not self._tasks:
+            self.pipeline.start()
+            self._tasks = [
+                asyncio.create_task(self._listen_forever()),
+                asyncio.create_task(self._drain_forever()),
+                asyncio.create_task(self._ack_forever()),
+            ]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.pipeline.close(drain=True)
+        if self._deferred:
+            # Отложенные отправки досылаются по своим таймерам — дожидаемся их подтверждения
+            await asyncio.wait(list(self._deferred), timeout=60)
+        await self._flush_acks()
+
+    @property
+    def listening(self) -> bool:
+        return self._listening
+
+    @property
+    def leader(self) -> bool:
+        return self._leader
+
+    def _on_notify(self, _conn, pid, channel, payload):
+        self.wakeups += 1
+        self._wakeup.set()
+
+    async def _process(self, item):
+        outbox_id, tg_user_id, payload = item
+        await self._deferred_slots.acquire()
+        try:
+            result = await self.handler(tg_user_id, payload)
+        except asyncio.CancelledError:
+            self._deferred_slots.release()
+            raise
+        except Exception as e:
+            self._deferred_slots.release()
+            self._finish(outbox_id, e)
+            raise
+        if asyncio.isfuture(result):
+            def acked(future):
+                self._deferred.discard(future)
+                self._deferred_slots.release()
+                if future.cancelled():
+                    return
+                self._finish(outbox_id, future.exception())
+
+            self._deferred.add(result)
+            result.add_done_callback(acked)
+        else:
+            self._deferred_slots.release()
+            self._acks.append(outbox_id)
+
+    def _finish(self, outbox_id: int, error: Exception = None):
+        if error is None or isinstance(error, PERMANENT_ERRORS):
+            self._acks.append(outbox_id)
+        else:
+            self.retried += 1
+            logger.warning(f"outbox {outbox_id}: временная ошибка ({error!r}), повтор после аренды")
+
+    async def _flush_acks(self):
+        if not self._acks:
+            return
+        ids, self._acks = self._acks, []
+        try:
+            await self.database.ack_client_updates(ids)
+            self.acked += len(ids)
+        except Exception as e:
+            logger.error(f"Не удалось отметить доставку outbox: {e}")
+            self._acks.extend(ids)
+
+    # Забирает недоставленные строки пачками, пока они есть и процесс остаётся лидером
+    async def drain(self):
+        while self._leader:
+            rows = await self.database.claim_client_updates(self.batch_size, self.lease)
+            if not rows:
+                return
+            self.claimed += len(rows)
+            for row in rows:
+                tg_user_id = row['tg_user_id']
+                await self.pipeline.submit(tg_user_id, (row['id'], tg_user_id, json.loads(row['payload'])))
+            if len(rows) < self.batch_size:
+                return
+
+    # ----------background_tasks-------------
+    async def _drain_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass  # страховочный опрос на случай потерянного NOTIFY
+            self._wakeup.clear()
+            if not self._leader:
+                continue
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error(f"Ошибка при чтении client_update_outbox: {e}")
+
+    async def _ack_forever(self, interval: float = 1.0, purge_every: float = 3600):
+        last_purge = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            await self._flush_acks()
+            if time.monotonic() - last_purge >= purge_every:
+                last_purge = time.monotonic()
+                try:
+                    await self.database.purge_client_updates(self.keep_days)
+                except Exception as e:
+                    logger.error(f"Не удалось очистить client_update_outbox: {e}")
+
+    async def _listen_forever(self):
+        delay = 1
+        while True:
+            conn = None
+            try:
+                conn = await self.connect()
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: lost.set())
+                delay = 1
+                # Горячий резерв: ждём, пока блокировку не отпустит текущий лидер
+                standby = False
+                while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", LEADER_LOCK_KEY):
+                    if not standby:
+                        standby = True
+                        logger.warning("client_update: другой процесс уже лидер, ожидание в резерве...")
+                    await asyncio.sleep(self.standby_interval)
+                if self.on_leader:
+                    self.on_leader()
+                self._leader = True
+                self.elections += 1
+                logger.warning("client_update: процесс стал лидером, outbox разбирается здесь")
+
+                await conn.add_listener(CHANNEL, self._on_notify)
+                self._listening = True
+                logger.info("Listening on client_update...")
+                # Всё, что накопилось, пока не слушали, — забираем сразу
+                self._wakeup.set()
+                # Пинг не реже standby_interval и с тем же таймаутом: потеряв соединение
+                # (и блокировку), лидер должен перестать отправлять раньше, чем резерв займёт его место.
+                # Без таймаута пинг на «зависшем» TCP ждал бы, пока ядро не бросит ретрансмиты
+                ping = min(self.poll_interval, self.standby_interval)
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), timeout=ping)
+                    except asyncio.TimeoutError:
+                        try:
+                            await conn.fetchval("SELECT 1", timeout=self.standby_interval)
+                        except asyncio.TimeoutError:
+                            self._leader = False
+                            logger.warning("client_update: соединение лидера не отвечает, лидерство снято")
+                            break
+                logger.warning("Соединение слушателя client_update потеряно, переподключение...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"client_update listener error: {e}. Reconnecting in {delay}s...")
+            finally:
+                self._leader = False
+                self._listening = False
+                if conn is not None and not conn.is_closed():
+                    # Закрытие соединения освобождает и блокировку лидера.
+                    # Зависшее соединение закрываем без ожидания ответа сервера
+                    try:
+                        await conn.close(timeout=self.standby_interval)
+                    except Exception:
+                        conn.terminate()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
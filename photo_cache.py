@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PhotoCache:
+    # Кэш telegram file_id для фото с диска.
+    # Первый раз файл загружается в Telegram, дальше отправляется ссылкой на file_id.
+    # Запись действительна, пока совпадают mtime и размер файла; при их изменении
+    # сверяется хэш содержимого, и если он другой — файл загружается заново.
+    def __init__(self, database, max_size: int = 1024, preprocessor=None):
+        self.database = database
+        self.max_size = max_size
+        self.preprocessor = preprocessor  # ImagePreprocessor: что загружать вместо исходного файла
+        self._lru: OrderedDict = OrderedDict()  # path -> (mtime_ns, size, content_hash, file_id)
+        self._locks: dict = {}
+        self._lookups: dict = {}  # (path, mtime_ns, size) -> задача поиска file_id
+
+        # Счётчики
+        self.hits = 0
+        self.misses = 0
+        self.uploads = 0
+
+    # ----------helping_methods-------------
+    def _remember(self, path: str, entry: tuple):
+        self._lru[path] = entry
+        self._lru.move_to_end(path)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    # Файл для загрузки: подготовленная копия, если есть препроцессор
+    async def _upload_file(self, path: str) -> FSInputFile:
+        if self.preprocessor is not None:
+            return FSInputFile(await self.preprocessor.prepare(path))
+        return FSInputFile(path)
+
+    def invalidate(self, path: str):
+        self._lru.pop(path, None)
+
+    # file_id и хэш файла. Одновременные поиски одного и того же файла (path, mtime, size)
+    # ждут один общий: хэш считается и база опрашивается один раз, а не на каждую отправку
+    async def _lookup(self, path: str, mtime_ns: int, size: int):
+        entry = self._lru.get(path)
+        if entry and entry[0] == mtime_ns and entry[1] == size:
+            self._lru.move_to_end(path)
+            return entry[3], entry[2]
+
+        key = (path, mtime_ns, size)
+        task = self._lookups.get(key)
+        if task is None:
+            task = self._lookups[key] = asyncio.ensure_future(self._lookup_once(path, mtime_ns, size))
+            task.add_done_callback(lambda _task: self._lookups.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _lookup_once(self, path: str, mtime_ns: int, size: int):
+        entry = self._lru.get(path)
+        if entry is None:
+            row = await self.database.get_photo_cache_entry(path)
+            if row:
+                entry = (row['mtime_ns'], row['size'], row['content_hash'], row['file_id'])
+                self._remember(path, entry)
+        if entry and entry[0] == mtime_ns and entry[1] == size:
+            self._lru.move_to_end(path)
+            return entry[3], entry[2]
+
+        # Файл изменился (или ещё не встречался) — сверяем содержимое
+        content_hash = await asyncio.to_thread(file_hash, path)
+        if entry and entry[2] == content_hash:
+            file_id = entry[3]
+        else:
+            file_id = await self.database.get_photo_file_id_by_hash(content_hash)
+        if file_id:
+            await self._store(path, mtime_ns, size, content_hash, file_id)
+        else:
+            # Запоминаем и промах (только в памяти): повторная отправка до загрузки
+            # не будет заново хэшировать файл и ходить в базу
+            self._remember(path, (mtime_ns, size, content_hash, None))
+        return file_id, content_hash
+
+    async def _store(self, path, mtime_ns, size, content_hash, file_id):
+        self._remember(path, (mtime_ns, size, content_hash, file_id))
+        await self.database.save_photo_cache_entry(path, mtime_ns, size, content_hash, file_id)
+
+    async def _send_cached(self, bot, chat_id: int, path: str, **kwargs):
+        st = os.stat(path)
+        file_id, content_hash = await self._lookup(path, st.st_mtime_ns, st.st_size)
+        if file_id:
+            try:
+                message = await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+                self.hits += 1
+                return message, st, content_hash
+            except TelegramBadRequest as e:
+                logger.warning(f"file_id для {path} недействителен, загружаем заново: {e}")
+                self.invalidate(path)
+                await self.database.delete_photo_cache_entry(path)
+        return None, st, content_hash
+
+    # Отправляет фото по пути на диске, по возможности без повторной загрузки
+    async def send_photo(self, bot, chat_id: int, path: str, **kwargs):
+        if not os.path.exists(path):
+            # Не локальный файл — URL или готовый file_id
+            return await bot.send_photo(chat_id=chat_id, photo=path, **kwargs)
+
+        message, _, _ = await self._send_cached(bot, chat_id, path, **kwargs)
+        if message:
+            return message
+
+        # Загружать один и тот же файл параллельно нет смысла:
+        # остальные отправки дождутся первой загрузки и возьмут её file_id
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            message, st, content_hash = await self._send_cached(bot, chat_id, path, **kwargs)
+            if message:
+                return message
+
+            self.misses += 1
+            message = await bot.send_photo(chat_id=chat_id, photo=await self._upload_file(path), **kwargs)
+            self.uploads += 1
+            if message.photo:
+                await self._store(path, st.st_mtime_ns, st.st_size, content_hash, message.photo[-1].file_id)
+        self._locks.pop(path, None)
+        return message
+
+    # Для каждого пути: (path, stat, content_hash, file_id); не локальные файлы — (path, None, None, path)
+    async def _resolve(self, paths):
+        files = []
+        for path in paths:
+            if not os.path.exists(path):
+                files.append((path, None, None, path))
+                continue
+            st = os.stat(path)
+            file_id, content_hash = await self._lookup(path, st.st_mtime_ns, st.st_size)
+            files.append((path, st, content_hash, file_id))
+        return files
+
+    async def _send_group(self, bot, chat_id: int, files, caption):
+        async def media():
+            return [
+                InputMediaPhoto(media=file_id or await self._upload_file(path), caption=caption if i == 0 else None)
+                for i, (path, _, _, file_id) in enumerate(files)
+            ]
+
+        try:
+            messages = await bot.send_media_group(chat_id=chat_id, media=await media())
+        except TelegramBadRequest as e:
+            cached = [f for f in files if f[1] is not None and f[3]]
+            if not cached:
+                raise
+            # Какой-то из file_id недействителен — загружаем локальные файлы заново
+            logger.warning(f"file_id в альбоме недействителен, загружаем заново: {e}")
+            for path, _, _, _ in cached:
+                self.invalidate(path)
+                await self.database.delete_photo_cache_entry(path)
+            files = [(p, st, h, None if st is not None else f) for p, st, h, f in files]
+            messages = await bot.send_media_group(chat_id=chat_id, media=await media())
+
+        for (path, st, content_hash, file_id), message in zip(files, messages):
+            if st is None:
+                continue
+            if file_id:
+                self.hits += 1
+            elif message.photo:
+                self.misses += 1
+                self.uploads += 1
+                await self._store(path, st.st_mtime_ns, st.st_size, content_hash, message.photo[-1].file_id)
+        return messages
+
+    # Отправляет несколько фото одним альбомом (sendMediaGroup); caption — подпись к первому фото.
+    # Закэшированные фото уходят по file_id, остальные загружаются, и их file_id запоминаются.
+    async def send_media_group(self, bot, chat_id: int, paths, caption: str = None):
+        files = await self._resolve(paths)
+        missing = sorted({path for path, st, _, file_id in files if st is not None and not file_id})
+        if not missing:
+            return await self._send_group(bot, chat_id, files, caption)
+
+        # Как и в send_photo, одни и те же файлы параллельно не загружаем.
+        # Блокировки берутся в порядке путей, чтобы альбомы не ждали друг друга по кругу
+        async with AsyncExitStack() as stack:
+            for path in missing:
+                await stack.enter_async_context(self._locks.setdefault(path, asyncio.Lock()))
+            files = await self._resolve(paths)
+            messages = await self._send_group(bot, chat_id, files, caption)
+        for path in missing:
+            self._locks.pop(path, None)
+        return messages
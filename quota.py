@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationQuota:
+    # Дневной лимит уведомлений на клиента по полям client_info.notif_count / last_notif_date.
+    # Проверка идёт по счётчикам в памяти; из базы счётчик клиента читается один раз,
+    # когда клиент впервые встретился процессу. Раз в flush_interval секунд в базу
+    # одним UPDATE ... FROM unnest(...) добавляются приросты за день, а не абсолютные
+    # значения, поэтому запись не затирает то, что успел отправить другой процесс.
+    # Триггер client_update на эти столбцы не реагирует (AFTER UPDATE OF только
+    # наблюдаемые столбцы), поэтому запись счётчиков не порождает новых уведомлений.
+    # Уведомления отправляет один процесс (лидер outbox); став лидером, процесс вызывает
+    # forget() и перечитывает счётчики из базы, а не продолжает со своих устаревших.
+    def __init__(self, database, daily_limit: int = 20, flush_interval: float = 5, max_clients: int = 100000):
+        self.database = database
+        self.daily_limit = daily_limit
+        self.flush_interval = flush_interval
+        self.max_clients = max_clients
+        self._counters: OrderedDict = OrderedDict()  # tg_user_id -> [день, отправлено за день]
+        self._pending: dict = {}  # (tg_user_id, день) -> ещё не записанный в базу прирост
+        self._task = None
+
+        # Счётчики
+        self.allowed = 0
+        self.blocked = 0
+        self.flushes = 0
+
+    # ----------helping_methods-------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_forever())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def dirty(self) -> int:
+        return len(self._pending)
+
+    def _evict(self):
+        # Вытесняем только счётчики без незаписанных приростов
+        dirty = {tg for tg, _ in self._pending}
+        while len(self._counters) > self.max_clients:
+            for tg in self._counters:
+                if tg not in dirty:
+                    del self._counters[tg]
+                    break
+            else:
+                return
+
+    # Забывает счётчики в памяти: следующая проверка прочитает их из базы.
+    # Незаписанные приросты не теряются — они уйдут в базу при следующей записи
+    def forget(self):
+        self._counters.clear()
+
+    async def _counter(self, tg_user_id: int) -> list:
+        counter = self._counters.get(tg_user_id)
+        if counter is None:
+            row = await self.database.get_notif_counter(tg_user_id)
+            counter = self._counters.get(tg_user_id)
+            if counter is None:
+                counter = [row['last_notif_date'], row['notif_count'] or 0] if row else [date.today(), 0]
+                # Ещё не записанное этим процессом в базе не видно
+                pending = self._pending.get((tg_user_id, counter[0]))
+                if pending:
+                    counter[1] += pending
+                self._counters[tg_user_id] = counter
+                self._evict()
+        self._counters.move_to_end(tg_user_id)
+        return counter
+
+    # Можно ли отправить клиенту ещё одно уведомление сегодня; если да — сразу учитывает его
+    async def allow(self, tg_user_id: int) -> bool:
+        if self.daily_limit <= 0:
+            return True
+        counter = await self._counter(tg_user_id)
+        today = date.today()
+        if counter[0] != today:
+            # Новый день — счётчик начинается заново
+            counter[0], counter[1] = today, 0
+        if counter[1] >= self.daily_limit:
+            self.blocked += 1
+            return False
+        counter[1] += 1
+        key = (tg_user_id, today)
+        self._pending[key] = self._pending.get(key, 0) + 1
+        self.allowed += 1
+        return True
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        # Одним запросом клиент может обновиться только один раз, поэтому
+        # приросты разных дней (переход через полночь) пишутся по дням, по порядку
+        for day in sorted({day for _, day in pending}):
+            items = [(tg, delta) for (tg, d), delta in pending.items() if d == day]
+            try:
+                await self.database.save_notif_counters(
+                    [tg for tg, _ in items], [delta for _, delta in items], [day] * len(items)
+                )
+                self.flushes += 1
+            except Exception as e:
+                logger.error(f"Не удалось сохранить счётчики уведомлений: {e}")
+                # Возвращаем незаписанное (и всё, что за это время добавилось)
+                for (tg, d), delta in pending.items():
+                    if d >= day:
+                        self._pending[(tg, d)] = self._pending.get((tg, d), 0) + delta
+                return
+
+    # ----------background_tasks-------------
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
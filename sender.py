@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    SendMessage, SendPhoto, SendMediaGroup, SendDocument, EditMessageText,
+    EditMessageReplyMarkup, CopyMessage, ForwardMessage,
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты очереди: ответы пользователю идут раньше массовых уведомлений
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Методы Bot API, которые Telegram ограничивает по частоте
+LIMITED_METHODS = (
+    SendMessage, SendPhoto, SendMediaGroup, SendDocument, EditMessageText,
+    EditMessageReplyMarkup, CopyMessage, ForwardMessage,
+)
+
+# Приоритет текущего контекста (по умолчанию — интерактивный ответ)
+send_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority():
+    # Все отправки внутри блока попадают в очередь массовых уведомлений
+    token = send_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    # Глобальный планировщик исходящих запросов.
+    # Подключается как request-middleware сессии бота, поэтому через него
+    # проходят все вызовы bot.send_* и message.answer(...).
+    def __init__(self, rate: float = 30, chat_interval: float = 1.0, max_retries: int = 3):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+
+        self._tokens = float(rate)
+        self._last_refill = time.monotonic()
+        self._chat_next: dict = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._delayed = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task = None
+
+        # Счётчики
+        self.granted = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # ----------helping_methods-------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Освобождаем ожидающих, чтобы не зависли при остановке
+        for _, _, _, fut, _ in self._heap:
+            if not fut.done():
+                fut.cancel()
+        self._heap.clear()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._heap) + self._delayed,
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "wait_avg": self.wait_total / self.granted if self.granted else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+    def _refill(self, now: float):
+        self._tokens = min(float(self.rate), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _push(self, item):
+        heapq.heappush(self._heap, item)
+        self._wakeup.set()
+
+    def _release_delayed(self, item):
+        self._delayed -= 1
+        self._push(item)
+
+    async def _acquire(self, chat_id, priority: int):
+        fut = asyncio.get_running_loop().create_future()
+        self._push((priority, next(self._seq), chat_id, fut, time.monotonic()))
+        await fut
+
+    def _penalize(self, chat_id, retry_after: float):
+        until = time.monotonic() + retry_after
+        self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), until)
+
+    # Выдаёт разрешения на отправку: не чаще rate в секунду глобально
+    # и не чаще одного сообщения в chat_interval для каждого чата.
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            item = heapq.heappop(self._heap)
+            priority, seq, chat_id, fut, enqueued = item
+            if fut.done():
+                continue
+
+            ready = self._chat_next.get(chat_id, 0.0)
+            if ready > now:
+                # Чат ещё не остыл — возвращаем запрос с тем же seq, порядок внутри чата сохраняется
+                self._delayed += 1
+                loop.call_later(ready - now, self._release_delayed, item)
+                continue
+
+            self._tokens -= 1
+            if chat_id is not None:
+                self._chat_next[chat_id] = now + self.chat_interval
+            waited = now - enqueued
+            self.granted += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            fut.set_result(None)
+
+            # Не даём словарю расти бесконечно
+            if len(self._chat_next) > 10000:
+                self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, LIMITED_METHODS) or self._task is None:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = send_priority.get()
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retries += 1
+                self._penalize(chat_id, e.retry_after)
+                logger.warning(f"Flood wait {e.retry_after}s для чата {chat_id} (попытка {attempt})")
+                if attempt > self.max_retries:
+                    self.failed += 1
+                    raise
+            except Exception:
+                self.failed += 1
+                raise
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from datetime import date, datetime, timedelta
+
+# Периоды, которые админ выбирает кнопками (дней)
+RANGES = (1, 7, 30, 90)
+
+DAILY_TITLES = (
+    ('registrations', 'регистраций'),
+    ('notifications', 'уведомлений'),
+    ('users', 'новых пользователей'),
+)
+
+
+class StatsSnapshot:
+    # Снимок таблиц stats_total и stats_daily за последние max_days дней
+    def __init__(self, rows, day_from: date):
+        self.day_from = day_from
+        self.taken_at = datetime.now()
+        self.totals: dict = {}  # metric -> value
+        self.daily: dict = {}  # (day, metric) -> value
+        for row in rows:
+            if row['day'] is None:
+                self.totals[row['metric']] = row['value']
+            else:
+                self.daily[(row['day'], row['metric'])] = row['value']
+
+    def statuses(self) -> list:
+        result = []
+        for metric, value in self.totals.items():
+            if metric.startswith('status:') and value:
+                result.append((metric.split(':', 1)[1], value))
+        return sorted(result, key=lambda s: (not s[0].isdigit(), int(s[0]) if s[0].isdigit() else 0))
+
+    def sum(self, metric: str, start: date, end: date) -> int:
+        total = 0
+        day = start
+        while day <= end:
+            total += self.daily.get((day, metric), 0)
+            day += timedelta(days=1)
+        return total
+
+
+class StatsCache:
+    # Последний снимок статистики в памяти процесса на ttl секунд.
+    # Снимок читается одним запросом сразу за max_days дней, а периоды дашборда
+    # считаются из него, поэтому переключение кнопок не ходит в базу.
+    # Одновременные запросы после истечения ttl ждут одного чтения.
+    def __init__(self, database, ttl: float = 30, max_days: int = 90):
+        self.database = database
+        self.ttl = ttl
+        self.max_days = max_days
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+        # Счётчики
+        self.hits = 0
+        self.loads = 0
+
+    # ----------helping_methods-------------
+    def _fresh(self) -> bool:
+        return self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def snapshot(self) -> StatsSnapshot:
+        if self._fresh():
+            self.hits += 1
+            return self._snapshot
+        async with self._lock:
+            if self._fresh():
+                self.hits += 1
+                return self._snapshot
+            day_from = date.today() - timedelta(days=self.max_days - 1)
+            rows = await self.database.get_stats(day_from)
+            self._snapshot = StatsSnapshot(rows, day_from)
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+        return self._snapshot
+
+
+# Текст дашборда за последние days дней (включая сегодня).
+# До двух недель — разбивка по дням, дальше — по неделям (с понедельника).
+def render_stats(snapshot: StatsSnapshot, days: int) -> str:
+    today = date.today()
+    start = max(today - timedelta(days=days - 1), snapshot.day_from)
+    lines = [
+        f"Статистика на {snapshot.taken_at.strftime('%d.%m.%Y %H:%M')}",
+        f"Клиентов: {snapshot.totals.get('role:client', 0)}, админов: {snapshot.totals.get('role:admin', 0)}",
+    ]
+    statuses = snapshot.statuses()
+    if statuses:
+        lines.append("По статусам: " + ', '.join(
+            f"{status if status != 'null' else 'без статуса'}: {value}" for status, value in statuses
+        ))
+
+    period = 'сегодня' if days == 1 else f"за {(today - start).days + 1} дн."
+    lines.append('')
+    lines.append(f"{period.capitalize()}: " + ', '.join(
+        f"{title} {snapshot.sum(metric, start, today)}" for metric, title in DAILY_TITLES
+    ))
+    if days == 1:
+        return '\n'.join(lines)
+
+    step = 1 if days <= 14 else 7
+    lines.append('По дням:' if step == 1 else 'По неделям:')
+    # Свежие периоды сверху; неделя начинается с понедельника, первая может быть неполной
+    end = today
+    while end >= start:
+        begin = max(end - timedelta(days=end.weekday() if step == 7 else 0), start)
+        label = begin.strftime('%d.%m') if step == 1 else f"{begin.strftime('%d.%m')}-{end.strftime('%d.%m')}"
+        lines.append(f"{label}: " + ', '.join(
+            f"{snapshot.sum(metric, begin, end)}" for metric, _ in DAILY_TITLES
+        ))
+        end = begin - timedelta(days=1)
+    lines.append("(регистрации, уведомления, новые пользователи)")
+    return '\n'.join(lines)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Внешний middleware апдейтов: защищает базу от повторных нажатий и флуда.
+    # 1. Токен-бакет на пользователя: не больше rate апдейтов в секунду с запасом burst.
+    # 2. Повтор того же callback (пользователь, data, сообщение) или той же команды
+    #    в течение dedup_window секунд отбрасывается.
+    # 3. Апдейты одного пользователя обрабатываются строго по очереди,
+    #    поэтому двойное нажатие не проходит через FSM параллельно.
+    # Бакеты и отпечатки лежат в LRU-словарях на max_users записей: O(1) на апдейт.
+    def __init__(self, rate: float = 1.0, burst: int = 5, dedup_window: float = 2.0, max_users: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_window = dedup_window
+        self.max_users = max_users
+        self._buckets: OrderedDict = OrderedDict()  # user_id -> [tokens, last]
+        self._seen: OrderedDict = OrderedDict()  # отпечаток апдейта -> время первого появления
+        self._locks: dict = {}  # user_id -> [Lock, число апдейтов пользователя в работе]
+
+        # Счётчики
+        self.passed = 0
+        self.throttled = 0
+        self.duplicates = 0
+
+    # ----------helping_methods-------------
+    def _allow(self, user_id: int, now: float) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [float(self.burst), now]
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    @staticmethod
+    def _fingerprint(user_id: int, update: Update):
+        callback = update.callback_query
+        if callback is not None:
+            message_id = callback.message.message_id if callback.message else callback.inline_message_id
+            return user_id, callback.data, message_id
+        message = update.message
+        if message is not None and message.text and message.text.startswith('/'):
+            return user_id, message.text.strip(), None
+        return None
+
+    def _is_duplicate(self, fingerprint, now: float) -> bool:
+        # Окно одинаковое для всех, поэтому порядок вставки совпадает с порядком устаревания
+        while self._seen:
+            seen_at = next(iter(self._seen.values()))
+            if now - seen_at < self.dedup_window and len(self._seen) <= self.max_users:
+                break
+            self._seen.popitem(last=False)
+        if fingerprint in self._seen:
+            return True
+        self._seen[fingerprint] = now
+        return False
+
+    # Отброшенный callback всё равно подтверждаем, иначе кнопка крутится до таймаута Telegram.
+    # answerCallbackQuery не проходит через планировщик отправки
+    @staticmethod
+    async def _answer_dropped(update: Update, data, text: str = None):
+        callback = update.callback_query
+        if callback is None:
+            return
+        try:
+            await data['bot'].answer_callback_query(callback.id, text=text)
+        except Exception as e:
+            logger.info(f"Не удалось ответить на отброшенный callback: {e}")
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        fingerprint = self._fingerprint(user.id, event)
+        if fingerprint is not None and self._is_duplicate(fingerprint, now):
+            self.duplicates += 1
+            await self._answer_dropped(event, data)
+            return None
+        if not self._allow(user.id, now):
+            self.throttled += 1
+            logger.info(f"Апдейт пользователя {user.id} отброшен: превышен лимит")
+            await self._answer_dropped(event, data, "Слишком часто, подождите немного")
+            return None
+        self.passed += 1
+
+        entry = self._locks.get(user.id)
+        if entry is None:
+            entry = self._locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[user.id]
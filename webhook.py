@@ -0,0 +1,189 @@
+# Webhook-режим как альтернатива main.py (polling).
+#
+# Главный процесс поднимает aiohttp-сервер, принимает апдейты от Telegram и по from_user.id
+# раскладывает их по N процессам-обработчикам: апдейты одного пользователя всегда попадают
+# в один процесс и обрабатываются там по порядку, поэтому FSM не ломается.
+# Каждый процесс поднимает свой Dispatcher из main.py и кормит его через dp.feed_update.
+#
+#   webhook_host=127.0.0.1 python webhook.py
+#   curl -X POST localhost:8080/webhook -d '{"update_id": 1, "message": {...}}'
+
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+
+from aiohttp import web
+
+from config import *
+
+logger = logging.getLogger(__name__)
+
+_STOP = None  # сигнал процессу-обработчику: дообработать очередь и выйти
+
+
+# Пользователь, от которого пришёл апдейт (или чат, если пользователя нет)
+def update_user_id(update: dict) -> int:
+    if not isinstance(update, dict):
+        raise ValueError("update должен быть JSON-объектом")
+    for key, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        sender = event.get('from') or event.get('user')
+        if sender and 'id' in sender:
+            return int(sender['id'])
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat and 'id' in chat:
+            return int(chat['id'])
+    return 0
+
+
+# -------------------------------------------------
+# Процесс-обработчик
+def worker_main(index: int, workers: int, queue):
+    # Ctrl+C получает вся группа процессов — останавливаемся только по сигналу из очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, workers, queue))
+
+
+async def _worker(index: int, workers: int, queue):
+    # У каждого процесса свой файл логов: ротация одного файла из нескольких процессов небезопасна
+    from logging_setup import setup_logging
+    base, ext = os.path.splitext(log_file)
+    setup_logging(
+        path=f"{base}.{index}{ext}", level=log_level, max_bytes=log_max_bytes, backup_count=log_backup_count,
+        rotate_when=log_rotate_when, json_lines=log_json, console=log_console,
+        rate_interval=log_rate_interval, rate_burst=log_rate_burst
+    )
+    import main
+    from notifications import NotificationPipeline
+
+    # Лимит Telegram общий на бота — делим его между процессами
+    main.send_scheduler.rate = send_rate / workers
+    main.listen_notifications = index == 0
+    if metrics_port:
+        main.metrics_port = metrics_port + index  # у каждого процесса свой порт метрик
+
+    bot, dp = main.bot, main.dp
+    dp.startup.register(main.on_startup)
+    dp.shutdown.register(main.on_shutdown)
+    await dp.emit_startup(bot=bot)
+
+    async def feed(raw: bytes):
+        await dp.feed_raw_update(bot, json.loads(raw))
+
+    # Внутри процесса: параллельно по пользователям, последовательно для одного пользователя
+    updates = NotificationPipeline(feed, workers=notify_workers, queue_size=webhook_queue_size)
+    updates.start()
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is _STOP:
+                break
+            user_id, raw = item
+            await updates.submit(user_id, raw)
+    finally:
+        await updates.close(drain=True)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        logger.warning(f"Webhook worker {index} stopped")
+
+
+# -------------------------------------------------
+# Главный процесс: приём апдейтов и шардирование
+class WebhookServer:
+    def __init__(self, workers: int = 4, queue_size: int = 1000, secret: str = None):
+        self.workers = max(1, workers)
+        self.secret = secret
+        ctx = multiprocessing.get_context('spawn')
+        self.queues = [ctx.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self.processes = [
+            ctx.Process(target=worker_main, args=(i, self.workers, q), daemon=False)
+            for i, q in enumerate(self.queues)
+        ]
+        self.draining = False
+        self.accepted = 0
+
+    def start_workers(self):
+        for process in self.processes:
+            process.start()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.draining:
+            return web.Response(status=503)
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if self.secret and not hmac.compare_digest(token.encode(), self.secret.encode()):
+            return web.Response(status=401)
+        raw = await request.read()
+        try:
+            user_id = update_user_id(json.loads(raw))
+        except ValueError:
+            return web.Response(status=400)
+
+        queue = self.queues[user_id % self.workers]
+        # Очередь процесса заполнена — ждём в потоке, не блокируя event loop сервера
+        await asyncio.get_running_loop().run_in_executor(None, queue.put, (user_id, raw))
+        self.accepted += 1
+        return web.Response()
+
+    # Плавная остановка: новые апдейты не принимаем, очереди дообрабатываются
+    async def drain(self, _app=None, timeout: float = 30):
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        for queue in self.queues:
+            await loop.run_in_executor(None, queue.put, _STOP)
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.error(f"Webhook worker {process.pid} не остановился за {timeout}s, завершаем")
+                process.terminate()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(webhook_path, self.handle)
+        app.on_shutdown.append(self.drain)
+        return app
+
+
+async def set_webhook(secret: str):
+    from aiogram import Bot
+    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    try:
+        await bot.set_webhook(webhook_url, secret_token=secret, drop_pending_updates=True)
+    finally:
+        await bot.session.close()
+
+
+def run():
+    from logging_setup import setup_logging
+    setup_logging(
+        path=log_file, level=log_level, max_bytes=log_max_bytes, backup_count=log_backup_count,
+        rotate_when=log_rotate_when, json_lines=log_json, console=log_console,
+        rate_interval=log_rate_interval, rate_burst=log_rate_burst
+    )
+    # Без секрета любой, кто достучится до порта, мог бы прислать апдейт от имени админа.
+    # Если адрес регистрирует сам бот, а секрет не задан, генерируем его на этот запуск
+    secret = webhook_secret
+    if not secret and webhook_url:
+        secret = secrets.token_urlsafe(32)
+        logger.warning("webhook_secret не задан, для setWebhook сгенерирован случайный секрет")
+    if not secret and webhook_host not in ('127.0.0.1', '::1', 'localhost'):
+        raise SystemExit(
+            f"webhook_secret не задан: без него сервер можно поднять только на localhost, а не на {webhook_host}"
+        )
+    server = WebhookServer(workers=webhook_workers, queue_size=webhook_queue_size, secret=secret)
+    server.start_workers()
+    app = server.app()
+    if webhook_url:
+        app.on_startup.append(lambda _app: set_webhook(secret))
+    web.run_app(app, host=webhook_host, port=webhook_port)
+
+
+if __name__ == '__main__':
+    run()